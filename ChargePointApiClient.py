@@ -4,11 +4,17 @@ from zeep import Client
 from zeep.wsse.username import UsernameToken
 from zeep.helpers import serialize_object
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import pytz
 import pandas as pd
-import numpy as np
 import os
+import time
 import hashlib
+import metrics
+import schema
+from ChargePointDatasetUtils import IdHasher, explode_ports, to_epoch_seconds, to_local_time
+from soap_transport import DEFAULT_WSDL_URL, RetryPolicy
 
 
 cwd=os.getcwd()
@@ -17,118 +23,170 @@ cwd=os.getcwd()
 
 class ChargePointApiClient:
 
-  def __init__(self, api_key, api_secret):
-    self.serv_impl = self.getApiServiceImpl(api_key, api_secret)
+  def __init__(self, api_key, api_secret, max_workers=4, transport=None, retry=None, wsdl_url=DEFAULT_WSDL_URL):
+    self.serv_impl = self.getApiServiceImpl(api_key, api_secret, transport, wsdl_url)
+    self.retry = retry or RetryPolicy() # backoff and throttling of every API call
     self.local_timezone = pytz.timezone('America/Vancouver')
     self.dt_format = '%Y-%m-%d %H:%M:%S'
     self.earliest = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+    self.max_workers = max_workers # number of pages requested concurrently
+    self.record_limit = 100 # number of return limit of the API service
+    self.hasher = IdHasher(digest_size=5) # shared by the session, station and alarm transforms
+
+  def _iter_pages(self, operation, searchQuery, records_key, more_key):
+    """
+    Yields the serialized records of each page of a paginated API call, in page order.
+
+    The first page is requested on its own, as most incremental queries fit in one page.
+    Once it reports more pages, up to max_workers pages are kept in flight, each one
+    advancing startRecord by the record limit. Pages requested past the last one (more
+    flag unset) are discarded.
+    """
+    name = operation_name(operation)
+    cycle = metrics.current_cycle() # the pages are fetched by the executor threads
+
+    def fetch(startRecord):
+      with metrics.attach(cycle):
+        t0 = time.perf_counter()
+        response = self.retry.call(operation, dict(searchQuery, startRecord=startRecord))
+        records = serialize_object(response[records_key]) or []
+        metrics.observe_page(name, time.perf_counter() - t0, len(records))
+        return records, response[more_key]
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      pending = deque()
+      startRecord, moreFlag = 1, 1
+      in_flight = 1 # until the first page tells whether there are more
+      while True:
+        while moreFlag and len(pending) < in_flight:
+          pending.append(executor.submit(fetch, startRecord))
+          startRecord += self.record_limit
+        if not pending: break
+
+        records, moreFlag = pending.popleft().result()
+        in_flight = self.max_workers
+        yield records
+        if not moreFlag: # the last page has arrived, drop the speculative requests
+          for future in pending: future.cancel()
+          pending.clear()
+
+  def _iter_batches(self, operation, searchQuery, records_key, more_key, key_fields, batch_size):
+    """
+    Groups the records of all pages into lists of about batch_size records, keeping the first
+    occurrence of each key. Only the keys of the records already yielded are retained.
+    """
+    batch, seen = [], set()
+    for page in self._iter_pages(operation, searchQuery, records_key, more_key):
+      for record in page:
+        key = tuple(record[field] for field in key_fields)
+        if key not in seen:
+          seen.add(key)
+          batch.append(record)
+      if len(batch) >= batch_size:
+        yield batch
+        batch = []
+    if batch:
+      yield batch
 
   def encrypt(self, obj, output_length=5):
 
-    hash_object = hashlib.blake2b(str(obj).encode(), digest_size=output_length)
-    return hash_object.hexdigest()
+    if output_length != self.hasher.digest_size:
+      return hashlib.blake2b(str(obj).encode(), digest_size=output_length).hexdigest()
+    return self.hasher.hash(obj) # memoized
 
 
-  def getApiServiceImpl(self, api_key, api_secret):
+  def getApiServiceImpl(self, api_key, api_secret, transport=None, wsdl_url=DEFAULT_WSDL_URL):
     """
     Returns a Chargepoint API service implementation instance using the provided API key and secret.
 
     Parameters:
     api_key (str): The Chargepoint API key to use for authentication.
     api_secret (str): The Chargepoint API secret to use for authentication.
+    transport (zeep.Transport): The transport to use, see soap_transport.build_transport.
+    wsdl_url (str): The location of the WSDL, e.g. a local stub service for testing.
 
     Returns:
     zeep.ClientService: A Chargepoint API service implementation instance.
     """
-    wsdl_url = "https://webservices.chargepoint.com/cp_api_5.1.wsdl"
-    client = Client(wsdl_url, wsse=UsernameToken(api_key, api_secret))
+    client = Client(wsdl_url, wsse=UsernameToken(api_key, api_secret), transport=transport)
     return client.service
 
-  def getAlarms(self, startTime, endTime):
-    alarm_data_list = []
-    moreFlag = 1
-    startRecord, recordLimit = 1, 100
-
+  def iterAlarms(self, startTime, endTime, batch_size=1000):
+    """Yields the alarms within a time range as transformed DataFrames of about batch_size rows."""
     searchQuery={
         'startTime': startTime,
         'endTime': endTime
     }
 
-    while moreFlag:
-      searchQuery['startRecord'] = startRecord
-      response = self.serv_impl.getAlarms(searchQuery)
-      alarm_data_list.extend(serialize_object(response['Alarms']))
-      moreFlag = response['moreFlag']
-      startRecord += recordLimit
+    # alarms of different stations, ports or types may share the same second
+    for records in self._iter_batches(self.serv_impl.getAlarms, searchQuery, 'Alarms', 'moreFlag',
+                                      ['stationID', 'portNumber', 'alarmType', 'alarmTime'], batch_size):
+      with metrics.stage('transform') as stage:
+        df_alarms = self._transform_alarms(records)
+        stage.rows = len(df_alarms)
+      yield df_alarms
 
+  def getAlarms(self, startTime, endTime):
+    batches = list(self.iterAlarms(startTime, endTime))
+    if not batches: return pd.DataFrame()
+    return schema.concat(batches, 'alarms').sort_values('alarm_ts', ascending=True)
+
+  def _transform_alarms(self, alarm_data_list):
     df_alarms = pd.DataFrame(alarm_data_list)
-    if df_alarms.empty: return df_alarms
     
     columns_selected = ['stationID',	'stationName',	'stationModel',	'orgID',	'portNumber',	'alarmType',	'alarmTime']
     columns_alias = ['station_id',	'station_name',	'model',	'org_id', 'port_no', 'alarm_type', 'alarm_ts', 'alarm_dt']
     df_alarms = df_alarms[columns_selected]
     df_alarms['alarmDt'] = df_alarms['alarmTime']
 
-    df_alarms[['stationID', 'orgID']] = df_alarms[['stationID', 'orgID']].apply(lambda x : x.apply(self.encrypt)) # hash
-    df_alarms['alarmTime'] = df_alarms['alarmTime'].apply(lambda x : str(int((x-self.earliest).total_seconds()))) # UTC timestamp integers
-    df_alarms['alarmDt'] = df_alarms['alarmDt'].apply(lambda x : x.tz_convert(self.local_timezone))\
-                                               .apply(lambda x : x.strftime(self.dt_format))
+    df_alarms[['stationID', 'orgID']] = df_alarms[['stationID', 'orgID']].apply(self.hasher.hash_series) # hash
+    df_alarms['alarmTime'] = to_epoch_seconds(df_alarms['alarmTime']) # UTC timestamp integers
+    df_alarms['alarmDt'] = to_local_time(df_alarms['alarmDt'], self.local_timezone, self.dt_format)
     df_alarms.columns = columns_alias
-    df_alarms['alarm_ts'] = df_alarms['alarm_ts'].astype(np.int64)
     df_alarms = df_alarms.sort_values('alarm_ts', ascending=True)
-    df_alarms['port_no'] = df_alarms['port_no'].astype(np.float16)
 
-    return df_alarms
+    return schema.enforce(df_alarms, 'alarms') # small int ports, categorical ids
     
 
   def getCPNInstances(self):
-    return self.serv_impl.getCPNInstances()
+    return self.retry.call(self.serv_impl.getCPNInstances)
 
   def getOrgsAndStationGroups(self, searchQuery={}):
-    self.serv_impl.getOrgsAndStationGroups(searchQuery)
+    self.retry.call(self.serv_impl.getOrgsAndStationGroups, searchQuery)
 
   def getStationGroups(self, orgID):
-    return self.serv_impl.getStationGroups(orgID)
+    return self.retry.call(self.serv_impl.getStationGroups, orgID)
 
   def getStationRights(self, searchQuery={}):
-    return self.serv_impl.getStationRights(searchQuery)
+    return self.retry.call(self.serv_impl.getStationRights, searchQuery)
 
   def getStationRightsProfile(self, sgID):
-    return self.serv_impl.getStationRightsProfile(sgID)
+    return self.retry.call(self.serv_impl.getStationRightsProfile, sgID)
 
   def getStationStatus(self, searchQuery={}):
-    return self.serv_impl.getStationStatus(searchQuery)
+    return self.retry.call(self.serv_impl.getStationStatus, searchQuery)
 
   def getStations(self, searchQuery={}):
-    response = self.serv_impl.getStations(searchQuery)
-    df_stations = pd.DataFrame(serialize_object(response["stationData"])) # raw data
+    t0 = time.perf_counter()
+    response = self.retry.call(self.serv_impl.getStations, searchQuery)
+    station_data = serialize_object(response["stationData"])
+    metrics.observe_page('getStations', time.perf_counter() - t0, len(station_data or []))
+    df_stations = pd.DataFrame(station_data) # raw data
 
     columns_selected = ['stationID', 'orgID', 'sgID', 'stationModel', 'stationActivationDate', 'timezoneOffset', 'Port', 'Address', 'stationManufacturer', 'stationName', 'Description']
 
     df_stations = df_stations[columns_selected] # filtered data
 
     # hash ID fields
-    df_stations[['stationID', 'orgID']] = df_stations[['stationID', 'orgID']].apply(lambda x : x.apply(self.encrypt))
+    df_stations[['stationID', 'orgID']] = df_stations[['stationID', 'orgID']].apply(self.hasher.hash_series)
 
     df_stations['sgID'] = df_stations['sgID'].apply(lambda x : x.replace(', ', ';')) # replace separators with semicolons
 
     # convert date to local timezone
-    df_stations['stationActivationDate'] = df_stations['stationActivationDate'].apply(lambda x : x.astimezone(self.local_timezone))\
-    .dt.strftime(self.dt_format)
-
-    # address nested port information
-    buf = list()
-    for index, row in df_stations.iterrows():
-      row_copy = row.copy()
-      row.Port = row.Port[0] # set the first port information
-      df_stations.iloc[index] = row # replace this row
-      row_copy.Port = row_copy.Port[1] # set the second port information
-      buf.append(row_copy) # add it to a buffer
-
-    df_new = pd.concat([df_stations, pd.DataFrame(buf)], axis=0).reset_index(drop=True) # concat the new rows to the end of dataframe
-    expanded_port = pd.json_normalize(df_new.Port) # break down all fields to the dataframe
-    expanded_port = expanded_port.drop('Connectors', axis=1)
-    df_new = pd.concat([df_new.drop('Port', axis=1), expanded_port], axis=1) # concat the expanded fields to the right
+    df_stations['stationActivationDate'] = to_local_time(df_stations['stationActivationDate'], self.local_timezone, self.dt_format)
+
+    # address nested port information, one row per port of each station
+    df_new = explode_ports(df_stations)
 
     columns_alias = ['station_id', 'org_id', 'station_group', 'model', 'activation_dt',
        'timezone_offset', 'address', 'manufacturer', 'station_name' ,
@@ -136,23 +194,23 @@ class ChargePointApiClient:
        'time_stamp', 'mode', 'connector', 'voltage', 'current', 'power',
        'estimated_cost', 'location_lat', 'location_long']
     df_new.columns = columns_alias
-    return df_new
+    return schema.enforce(df_new, 'stations')
 
 
-  def queryChargingSession(self, startTime, endTime=None):
-    """Queries charging session data within a specified time range.
+  def iterChargingSessions(self, startTime, endTime=None, batch_size=1000):
+    """Yields the charging sessions within a time range as transformed DataFrames.
+
+    Each page is converted as soon as it arrives, so memory is bounded by the batch size
+    rather than by the length of the time range.
 
     Args:
         startTime (datetime): The start time of the query range.
         endTime (datetime): The end time of the query range.
+        batch_size (int): The approximate number of sessions per DataFrame.
 
-    Returns:
-        pandas.DataFrame: A DataFrame containing the charging session data.
+    Yields:
+        pandas.DataFrame: A batch of charging session data.
     """
-    session_data_list = [] # the result list to be returned
-    moreFlag = 1 # flag that indicates whether the number of records exceeds 100
-    startRecord = 1 # the index of the first row in the result
-    recordLimit = 100 # number of return limit of the API service
     searchQuery = {
       'fromTimeStamp': startTime,
       # 'startRecord': startRecord
@@ -162,36 +220,58 @@ class ChargePointApiClient:
     if endTime: # if specified an end timestamp
       searchQuery['toTimeStamp'] = endTime
 
-    while moreFlag:
-      searchQuery['startRecord'] = startRecord # update the start record
-      response = self.serv_impl.getChargingSessionData(searchQuery)
-      session_data_list.extend(serialize_object(response['ChargingSessionData']))
-      moreFlag = response['MoreFlag'] # update the flag
-      startRecord += recordLimit # increment the index
+    # pages are fetched concurrently and merged in order, without duplicated sessions
+    for records in self._iter_batches(self.serv_impl.getChargingSessionData, searchQuery,
+                                      'ChargingSessionData', 'MoreFlag', ['sessionID'], batch_size):
+      with metrics.stage('transform') as stage:
+        df_session = self._transform_sessions(records)
+        stage.rows = len(df_session)
+      yield df_session
 
+  def queryChargingSession(self, startTime, endTime=None):
+    """Queries charging session data within a specified time range.
+
+    Args:
+        startTime (datetime): The start time of the query range.
+        endTime (datetime): The end time of the query range.
+
+    Returns:
+        pandas.DataFrame: A DataFrame containing the charging session data.
+    """
+    batches = list(self.iterChargingSessions(startTime, endTime))
+    if not batches: return self._transform_sessions([]) # no session in the time range
+    return schema.concat(batches, 'sessions')
+
+  def _transform_sessions(self, session_data_list):
     # columns selected
     columns_selected = ['sessionID','userID','credentialID','stationID','portNumber',
                         'startTime','endTime','Energy', 'totalChargingDuration', 'totalSessionDuration' ,'Address']
     columns_alias = ['session_id', 'user_id', 'credential_id', 'station_id', 'port_no',
                      'start_ts', 'end_ts', 'start_dt', 'end_dt', 'energy', 'total_charging_duration', 'total_session_duration', 'address']
 
+    if not session_data_list: return schema.enforce(pd.DataFrame(columns=columns_alias), 'sessions')
+
     # add two more columns for logging in local timezone
     df_session = pd.DataFrame(session_data_list)[columns_selected]
     df_session.insert(df_session.columns.get_loc('endTime') + 1, 'startTime_local', df_session['startTime'])
     df_session.insert(df_session.columns.get_loc('endTime') + 2, 'endTime_local', df_session['endTime'])
 
     # convert startTime and endTime to UTC integer seconds
-    
-    df_session[['startTime','endTime']] = df_session[['startTime','endTime']].apply(lambda x : (x-self.earliest).apply(lambda y: str(int(y.total_seconds()))))
+    df_session[['startTime','endTime']] = df_session[['startTime','endTime']].apply(to_epoch_seconds)
 
     # convert to local timezone and format the datetime
-    df_session[['startTime_local','endTime_local']] = df_session[['startTime_local','endTime_local']].apply(lambda x : x.dt.tz_convert(self.local_timezone))\
-                                                                                                     .apply(lambda x : x.dt.strftime(self.dt_format))
+    df_session[['startTime_local','endTime_local']] = df_session[['startTime_local','endTime_local']].apply(to_local_time, args=(self.local_timezone, self.dt_format))
 
     # hash ID feilds
-    df_session[['userID','stationID']] = df_session[['userID','stationID']].apply(lambda x : x.apply(self.encrypt))
+    df_session[['userID','stationID']] = df_session[['userID','stationID']].apply(self.hasher.hash_series)
 
     # rename the columns
     df_session.columns = columns_alias
 
-    return df_session
\ No newline at end of file
+    # int64 timestamps, durations in seconds, categorical ids
+    return schema.enforce(df_session, 'sessions')
+
+
+def operation_name(operation):
+  """The name of a zeep operation (or of a plain function standing in for one)."""
+  return getattr(operation, '_op_name', None) or getattr(operation, '__name__', 'unknown')
@@ -1,6 +1,11 @@
 # ChargePointDatasetUtils.py
 
-import logging, os
+import logging, os, hashlib, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import schema
 
 def get_logger(name, cwd, log_path):
   # initialize the logger
@@ -17,3 +22,98 @@ def get_logger(name, cwd, log_path):
   logger.addHandler(fh)
 
   return logger
+
+
+@contextmanager
+def atomic_write(path):
+  """
+  Yields a hidden temporary path next to path to write the file to. Once the block completes,
+  the file replaces path in one step, so readers never see a partial file; if the block
+  fails, the temporary file is removed and path is left as it was.
+  """
+  tmp = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+  try:
+    yield tmp
+    os.replace(tmp, path)
+  finally:
+    if os.path.exists(tmp): os.remove(tmp)
+
+
+EPOCH = pd.Timestamp(0, tz='UTC')
+
+def to_epoch_seconds(values):
+  """Converts a column of (timezone-aware) datetimes to int64 seconds since 1970-01-01 UTC."""
+  return ((pd.to_datetime(values, utc=True) - EPOCH) // pd.Timedelta(seconds=1)).astype(np.int64)
+
+def to_local_time(values, timezone, dt_format):
+  """Converts a column of datetimes to formatted strings in the given timezone."""
+  local = pd.to_datetime(values, utc=True).dt.tz_convert(timezone)
+  if dt_format != schema.LOCAL_TIME_FORMAT:
+    return local.dt.strftime(dt_format)
+  return schema.format_local_time(local.dt.tz_localize(None))
+
+def explode_ports(df_stations, column='Port'):
+  """
+  Expands the list of ports of every station into one row per port, with the port fields
+  (except the nested connectors) as columns to the right of the station fields.
+
+  Stations may have any number of ports. Rows are ordered by port position, i.e. the first
+  port of every station, then the second ports, and so on.
+  """
+  df = df_stations.explode(column)
+  df['port_position'] = df.groupby(level=0).cumcount()
+  df = df.sort_values('port_position', kind='stable').drop(columns='port_position').reset_index(drop=True)
+
+  ports = [port if isinstance(port, dict) else {} for port in df[column]] # stations without ports keep one empty row
+  expanded_port = pd.json_normalize(ports).drop(columns='Connectors', errors='ignore')
+  return pd.concat([df.drop(columns=column), expanded_port], axis=1)
+
+
+class IdHasher:
+  """
+  Pseudonymizes IDs with blake2b, memoizing the digests of the most recently seen IDs.
+
+  hash_series() hashes each distinct value of a column once, so the cost of a column
+  depends on its number of distinct IDs rather than on its length.
+  """
+
+  def __init__(self, digest_size=5, maxsize=100000):
+    self.digest_size = digest_size
+    self.maxsize = maxsize # number of digests kept in the cache
+    self.cache = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits, self.misses = 0, 0
+
+  def hash(self, obj):
+    key = str(obj)
+    with self.lock:
+      digest = self.cache.get(key)
+      if digest is not None:
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return digest
+      self.misses += 1
+    digest = hashlib.blake2b(key.encode(), digest_size=self.digest_size).hexdigest()
+    with self.lock:
+      self.cache[key] = digest
+      if len(self.cache) > self.maxsize:
+        self.cache.popitem(last=False) # evict the least recently used ID
+    return digest
+
+  def hash_series(self, values):
+    codes, uniques = pd.factorize(values)
+    digests = np.array([self.hash(obj) for obj in uniques] + [None], dtype=object)
+    result = digests[codes] # code -1 marks missing values, hashed one by one below
+    for i in np.nonzero(codes < 0)[0]:
+      result[i] = self.hash(values.iloc[i])
+    with self.lock:
+      self.hits += int((codes >= 0).sum()) - len(uniques) # repeated cells reuse the digest
+    return pd.Series(result, index=values.index, name=values.name)
+
+  @property
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+  def __repr__(self):
+    return f'IdHasher(hit rate {self.hit_rate:.1%}, {self.hits} hits, {self.misses} misses, {len(self.cache)} cached)'
@@ -0,0 +1,4 @@
+from analysis.stats import (
+  SESSION_DTYPES, load_sessions, add_duration, filter_outliers, user_stats, station_usage,
+  port_usage, port_energy, hourly_usage, compute_statistics, session_statistics,
+)
@@ -0,0 +1,167 @@
+# analysis/stats.py
+
+import os, hashlib, pickle
+import numpy as np
+import pandas as pd
+from ChargePointDatasetUtils import atomic_write
+
+# the columns of Sessions.csv used by the analysis and their types; ids are categorical,
+# so group-bys work on integer codes instead of strings
+SESSION_DTYPES = {
+  'user_id': 'category',
+  'station_id': 'category',
+  'port_no': 'Int8',
+  'start_ts': 'int64',
+  'end_ts': 'int64',
+  'start_dt': 'string',
+  'end_dt': 'string',
+  'energy': 'float64',
+}
+
+DT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# bump when a statistic changes, so results memoized by an older version are not reused
+STATS_VERSION = 2
+
+
+def load_sessions(path):
+  """Reads the columns of a sessions CSV file used by the analysis, with explicit types."""
+  return pd.read_csv(path, usecols=list(SESSION_DTYPES), dtype=SESSION_DTYPES)
+
+
+def add_duration(df):
+  """Adds the plugged-in duration in minutes."""
+  df = df.copy()
+  df['duration'] = (df['end_ts'] - df['start_ts']) / 60
+  return df
+
+
+def filter_outliers(df, column='duration', k=1.5):
+  """Drops the rows outside of [Q1 - k * IQR, Q3 + k * IQR] of a column."""
+  q1, q3 = df[column].quantile([0.25, 0.75])
+  iqr = q3 - q1
+  filtered = df[(df[column] >= q1 - k * iqr) & (df[column] <= q3 + k * iqr)]
+  # categories of the removed rows would otherwise show up with zero counts
+  categories = filtered.select_dtypes('category')
+  return filtered.assign(**{name: values.cat.remove_unused_categories() for name, values in categories.items()})
+
+
+def user_stats(df, n=10):
+  """
+  Returns the number of distinct users, the sessions per user, the n most frequent users
+  and their share of the total energy in percent.
+  """
+  # users with equal counts are ordered by their first session, as value_counts does for strings
+  codes, users = pd.factorize(df['user_id'])
+  counts = np.bincount(codes[codes >= 0], minlength=len(users))
+  order = np.argsort(-counts, kind='stable')
+  sessions_per_user = pd.Series(counts[order], index=pd.Index(np.asarray(users)[order], name='user_id'), name='count')
+  top_users = sessions_per_user.head(n).index
+  energy_per_user = df.groupby('user_id', observed=True)['energy'].sum()
+  contribution = energy_per_user[top_users].sum() / df['energy'].sum() * 100
+  return {
+    'distinct_users': len(users),
+    'sessions_per_user': sessions_per_user,
+    'top_users': top_users.tolist(),
+    'top_users_energy_percent': contribution,
+  }
+
+
+def station_usage(df):
+  """Returns the number of sessions per station."""
+  return df.groupby('station_id', observed=True).size().reset_index(name='total_sessions')
+
+
+def port_usage(df):
+  """Returns the number of sessions per station and port."""
+  return df.groupby(['station_id', 'port_no'], observed=True).size().reset_index(name='total_sessions')
+
+
+def port_energy(df):
+  """Returns the total energy per station and port."""
+  return df.groupby(['station_id', 'port_no'], observed=True).agg(total_energy=('energy', 'sum')).reset_index()
+
+
+def hourly_usage(df):
+  """
+  Returns, for every hour of the day in local time, the number of sessions starting and
+  ending in it and the mean energy of the sessions starting in it.
+  """
+  start_hour = pd.to_datetime(df['start_dt'], format=DT_FORMAT).dt.hour
+  end_hour = pd.to_datetime(df['end_dt'], format=DT_FORMAT).dt.hour
+  hours = pd.RangeIndex(24, name='hour')
+  return pd.DataFrame({
+    'sessions_started': np.bincount(start_hour.dropna().astype(int), minlength=24),
+    'sessions_ended': np.bincount(end_hour.dropna().astype(int), minlength=24),
+    'mean_energy': df['energy'].groupby(start_hour.to_numpy()).mean().reindex(hours).to_numpy(),
+  }, index=hours)
+
+
+def compute_statistics(data):
+  """
+  Computes the statistics of the paper from the sessions.
+
+  Parameters:
+  data (pandas.DataFrame): The sessions, as returned by load_sessions.
+
+  Returns:
+  dict: The statistics; all but port_energy are computed after removing the duration outliers.
+  """
+  data = add_duration(data)
+  filtered = filter_outliers(data)
+  stats = {
+    'sessions': len(data),
+    'filtered_sessions': len(filtered),
+    'duration': filtered['duration'].describe(),
+    'energy': filtered['energy'].describe(),
+    'first_start': pd.to_datetime(filtered['start_ts'].min(), unit='s'),
+    'last_start': pd.to_datetime(filtered['start_ts'].max(), unit='s'),
+    'station_usage': station_usage(filtered),
+    'port_usage': port_usage(filtered),
+    'port_energy': port_energy(data),
+    'hourly_usage': hourly_usage(filtered),
+    # the values behind the energy and duration histograms
+    'filtered_values': filtered[['energy', 'duration']].reset_index(drop=True),
+  }
+  stats.update(user_stats(filtered))
+  return stats
+
+
+def dataset_version(path):
+  """Identifies the content of a file by its path, size and modification time."""
+  stat = os.stat(path)
+  key = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{STATS_VERSION}'
+  return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+def session_statistics(path, cache_dir=None):
+  """
+  Returns compute_statistics of a sessions CSV file, memoized on disk.
+
+  The results are stored in cache_dir (by default .analysis_cache next to the file) under
+  the dataset version, so the file is only read again after it changed.
+  """
+  cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), '.analysis_cache')
+  cache_path = os.path.join(cache_dir, f'stats-{dataset_version(path)}.pkl')
+  if os.path.exists(cache_path):
+    with open(cache_path, 'rb') as f:
+      return pickle.load(f)
+
+  stats = compute_statistics(load_sessions(path))
+  os.makedirs(cache_dir, exist_ok=True)
+  with atomic_write(cache_path) as tmp, open(tmp, 'wb') as f:
+    pickle.dump(stats, f)
+  return stats
+
+
+if __name__ == '__main__':
+  # python -m analysis.stats data/Sessions.csv prints the statistics of a sessions file
+  import sys
+  stats = session_statistics(sys.argv[1] if len(sys.argv) > 1 else 'data/Sessions.csv')
+  print("Duration Statistics:")
+  print(stats['duration'])
+  print("Energy Statistics:")
+  print(stats['energy'])
+  print("Number of distinct users:", stats['distinct_users'])
+  print("Frequent users:", stats['top_users'])
+  print("Contribution to overall energy consumption (%):", stats['top_users_energy_percent'])
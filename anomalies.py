@@ -1,47 +1,186 @@
-import pandas as pd
-import numpy as np
-import os, configparser
-
-def scan_anomalies(cwd, session_data_path, anomaly_data_path, logger):
-
-  sessions = pd.read_csv(f'{cwd}/{session_data_path}',keep_default_na=False)
-
-  anomalies = dict(session_id=[], anomaly_description=[],value=[],unit=[])
-  for i, row in sessions.iterrows():
-    # Anomaly #1: Checks if plugged in time is longer than a day
-    plugged_in_duration = row['total_session_duration']
-    hour = pd.to_timedelta(plugged_in_duration) / np.timedelta64(1, 'h')
-    if hour >= 24:
-      anomalies['session_id'].append(row['session_id'])
-      anomalies['anomaly_description'].append('User plugged in for longer than 24 hours')
-      anomalies['value'].append(plugged_in_duration)
-      anomalies['unit'].append('hh:mm:ss')
-
-    
-    # Anomaly #2: Checks if charging power exceeds 7 kW
-    start_time_seconds = row['start_ts']
-    end_time_seconds  = row['end_ts']
-    plugged_in_time_hours = (end_time_seconds-start_time_seconds) / (3600)
-    if plugged_in_time_hours < 0.01:
-      power = 0
-    else:
-      power = row['energy'] / plugged_in_time_hours
-
-    if power > 7:
-      anomalies['session_id'].append(row['session_id'])
-      anomalies['anomaly_description'].append('Charging power exceeds 7 kW')
-      anomalies['value'].append(power)
-      anomalies['unit'].append('kW')
-
-    # Anomaly #3: Checks if active charging time is longer than 12 hours
-    charging_duration = row['total_charging_duration']
-    hour_c = pd.to_timedelta(charging_duration) / np.timedelta64(1, 'h')
-    if hour_c >= 12:
-      anomalies['session_id'].append(row['session_id'])
-      anomalies['anomaly_description'].append('User actively charging for longer than 12 hours')
-      anomalies['value'].append(charging_duration)
-      anomalies['unit'].append('hh:mm:ss')
-
-  df = pd.DataFrame(anomalies)
-  df.to_csv(f'{cwd}/{anomaly_data_path}', encoding='utf-8', index=False)
-  logger.info('Anomalies saved.')
+import pandas as pd
+import numpy as np
+import os, json, hashlib, configparser, operator
+from collections import namedtuple
+from schema import duration_seconds, format_duration
+from ChargePointDatasetUtils import atomic_write
+
+# Each rule flags the sessions whose `metric` satisfies `op threshold` and reports
+# the `value` column with the given `unit`. Rules are evaluated in this order for every
+# session, so new thresholds only need a new entry here.
+AnomalyRule = namedtuple('AnomalyRule', ['description', 'metric', 'op', 'threshold', 'value', 'unit'])
+
+ANOMALY_RULES = (
+  # Anomaly #1: Checks if plugged in time is longer than a day
+  AnomalyRule('User plugged in for longer than 24 hours', 'session_hours', '>=', 24, 'total_session_duration', 'hh:mm:ss'),
+  # Anomaly #2: Checks if charging power exceeds 7 kW
+  AnomalyRule('Charging power exceeds 7 kW', 'power', '>', 7, 'power', 'kW'),
+  # Anomaly #3: Checks if active charging time is longer than 12 hours
+  AnomalyRule('User actively charging for longer than 12 hours', 'charging_hours', '>=', 12, 'total_charging_duration', 'hh:mm:ss'),
+)
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq}
+
+ANOMALY_COLUMNS = ['session_id', 'anomaly_description', 'value', 'unit']
+
+# the session columns read from storage for a scan
+SCAN_COLUMNS = ['session_id', 'start_ts', 'end_ts', 'energy', 'total_charging_duration', 'total_session_duration']
+
+
+def duration_hours(durations):
+  """Converts a column of durations in seconds, or of hh:mm:ss strings, to hours."""
+  seconds = duration_seconds(durations).to_numpy(dtype=np.float64, na_value=np.nan)
+  return pd.Series(seconds / 3600, index=durations.index)
+
+
+def compute_metrics(sessions):
+  """Derives the per-session metrics referenced by the anomaly rules, one column at a time."""
+  metrics = pd.DataFrame(index=sessions.index)
+  metrics['session_hours'] = duration_hours(sessions['total_session_duration'])
+  metrics['charging_hours'] = duration_hours(sessions['total_charging_duration'])
+
+  # sessions plugged in for less than 0.01 hour are reported with zero power
+  # timestamps are int64 epoch seconds, both from the API client and from the stores
+  plugged_in_time_hours = (sessions['end_ts'] - sessions['start_ts']) / 3600
+  power = sessions['energy'] / plugged_in_time_hours
+  metrics['power'] = power.where(plugged_in_time_hours >= 0.01, 0)
+  return metrics
+
+
+def detect_anomalies(sessions, rules=ANOMALY_RULES):
+  """
+  Evaluates every rule as a boolean mask over the sessions.
+
+  Returns a DataFrame with the columns of Anomalies.csv, ordered by session and then
+  by rule, i.e. the same order the original row-by-row scan produced.
+  """
+  if sessions.empty: return pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+  metrics = compute_metrics(sessions)
+  position = np.arange(len(sessions))
+
+  frames = []
+  for order, rule in enumerate(rules):
+    mask = OPERATORS[rule.op](metrics[rule.metric], rule.threshold).to_numpy()
+    if not mask.any(): continue
+    values = (metrics if rule.value in metrics else sessions)[rule.value][mask]
+    if rule.unit == 'hh:mm:ss' and pd.api.types.is_numeric_dtype(values):
+      values = format_duration(values) # durations are stored in seconds, reported as in Sessions.csv
+    frames.append(pd.DataFrame({
+      'position': position[mask],
+      'order': order,
+      'session_id': sessions['session_id'].to_numpy()[mask],
+      'anomaly_description': rule.description,
+      'value': values.to_numpy(dtype=object),
+      'unit': rule.unit,
+    }))
+
+  if not frames: return pd.DataFrame(columns=ANOMALY_COLUMNS)
+  df = pd.concat(frames, ignore_index=True).sort_values(['position', 'order'], kind='stable')
+  return df[ANOMALY_COLUMNS].reset_index(drop=True)
+
+
+def rules_signature(rules=ANOMALY_RULES):
+  """Fingerprint of the rule definitions, stored with the watermark to detect rule changes."""
+  return hashlib.blake2b(repr(tuple(rules)).encode(), digest_size=8).hexdigest()
+
+
+def read_watermark(path):
+  if not os.path.exists(path): return None
+  with open(path) as f:
+    return json.load(f)
+
+
+def write_watermark(path, sessions, rows, **fields):
+  """Records how many stored sessions have been scanned and which one was the last."""
+  watermark = dict(rows=int(rows), session_id=None, end_ts=None, rules=rules_signature(), **fields)
+  if not sessions.empty:
+    watermark['session_id'] = str(sessions.iloc[-1]['session_id'])
+    watermark['end_ts'] = int(sessions.iloc[-1]['end_ts'])
+  with atomic_write(path) as tmp, open(tmp, 'w') as f:
+    json.dump(watermark, f)
+
+
+def truncate(path, size):
+  """Cuts off what was appended to a file after it had the given size."""
+  if os.path.getsize(path) > size:
+    with open(path, 'r+b') as f:
+      f.truncate(size)
+
+
+def scan_anomalies(cwd, session_store, anomaly_data_path, logger, watermark_path=None):
+
+  sessions = session_store.read(columns=SCAN_COLUMNS)
+
+  df = detect_anomalies(sessions)
+  df.to_csv(f'{cwd}/{anomaly_data_path}', encoding='utf-8', index=False)
+  if watermark_path:
+    write_watermark(f'{cwd}/{watermark_path}', sessions, len(sessions),
+                    data_bytes=os.path.getsize(f'{cwd}/{anomaly_data_path}'))
+  logger.info('Anomalies saved.')
+
+
+def scan_new_anomalies(cwd, session_store, anomaly_data_path, watermark_path, new_sessions, offset, logger, full_rescan=False):
+  """
+  Scans only the sessions merged in this cycle and appends their anomalies to Anomalies.csv.
+
+  Parameters:
+  session_store (storage.CsvStore or storage.ParquetStore): The store of the session data.
+  new_sessions (pandas.DataFrame): The rows just appended to the session store.
+  offset (int): The number of rows that preceded new_sessions in the session store.
+  full_rescan (bool): Rescan all stored sessions, e.g. after the rules were changed.
+
+  The watermark records how many rows have been scanned. A gap between the watermark and
+  offset (the worker stopped after merging but before scanning) is filled from the store;
+  a missing or inconsistent watermark, or a change of ANOMALY_RULES, triggers a full rescan.
+  The watermark also records the size of Anomalies.csv; rows appended after it (the worker
+  stopped before writing the watermark) are removed before the sessions are scanned again.
+  """
+  watermark = read_watermark(f'{cwd}/{watermark_path}')
+
+  if full_rescan:
+    reason = 'full rescan requested'
+  elif watermark is None or not os.path.exists(f'{cwd}/{anomaly_data_path}'):
+    reason = 'no previous scan found'
+  elif watermark['rules'] != rules_signature():
+    reason = 'anomaly rules changed'
+  elif watermark['rows'] > offset:
+    reason = 'watermark is ahead of the session data'
+  else:
+    reason = None
+
+  if reason is None and 'data_bytes' in watermark:
+    truncate(f'{cwd}/{anomaly_data_path}', watermark['data_bytes'])
+
+  if reason is None and watermark['rows'] < offset:
+    # resume from the watermark using the sessions already written to disk
+    sessions = session_store.read(columns=SCAN_COLUMNS)
+    rows = watermark['rows']
+    if rows and str(sessions.iloc[rows - 1]['session_id']) != watermark['session_id']:
+      reason = 'watermark does not match the session data'
+    else:
+      logger.info(f'Resuming anomaly scan from row {rows}.')
+      new_sessions, offset = sessions.iloc[rows:], rows
+
+  if reason is not None:
+    logger.info(f'Scanning all sessions for anomalies: {reason}.')
+    scan_anomalies(cwd, session_store, anomaly_data_path, logger, watermark_path)
+    return
+
+  df = detect_anomalies(new_sessions)
+  df.to_csv(f'{cwd}/{anomaly_data_path}', mode='a', header=False, encoding='utf-8', index=False)
+  if not new_sessions.empty:
+    write_watermark(f'{cwd}/{watermark_path}', new_sessions, offset + len(new_sessions),
+                    data_bytes=os.path.getsize(f'{cwd}/{anomaly_data_path}'))
+  logger.info(f'{len(df)} anomalies found in {len(new_sessions)} new session(s).')
+
+
+if __name__ == '__main__':
+  # python anomalies.py rescans all sessions, e.g. after ANOMALY_RULES were edited
+  import logging
+  from storage import open_store
+  logging.basicConfig(level=logging.INFO)
+  config = configparser.ConfigParser()
+  config.read('config.ini')
+  scan_anomalies(os.getcwd(), open_store('sessions'), config.get('Paths','anomaly_data_path'),
+                 logging.getLogger('Anomalies'), config.get('Paths','anomaly_watermark_path'))
@@ -0,0 +1,118 @@
+# backfill.py
+
+import os, json, threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import schema
+import metrics
+from ChargePointDatasetUtils import atomic_write
+
+
+def month_shards(start, end):
+  """Splits [start, end] into calendar-month shards of (name, shard_start, shard_end)."""
+  shard_start = start
+  while shard_start <= end:
+    next_month = (shard_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + timedelta(days=32)).replace(day=1)
+    shard_end = min(next_month - timedelta(seconds=1), end)
+    yield shard_start.strftime('%Y-%m'), shard_start, shard_end
+    shard_start = next_month
+
+
+class ShardManifest:
+  """Checkpoint of the completed shards, rewritten atomically after every shard."""
+
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.shards = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        self.shards = json.load(f)['shards']
+
+  def is_complete(self, name, shard_end):
+    # the last shard of a previous run may cover only part of its month
+    shard = self.shards.get(name)
+    return shard is not None and shard['end'] >= int(shard_end.timestamp())
+
+  def complete(self, name, shard_end, rows, file):
+    with self.lock:
+      self.shards[name] = dict(end=int(shard_end.timestamp()), rows=rows, file=file)
+      with atomic_write(self.path) as tmp, open(tmp, 'w') as f:
+        json.dump(dict(shards=self.shards), f, indent=1, sort_keys=True)
+
+
+def has_sessions(client, start, end):
+  """Tells whether any session lies in [start, end], from the first page of the query."""
+  batches = client.iterChargingSessions(start, end, batch_size=1)
+  try:
+    return next(batches, None) is not None
+  finally:
+    batches.close() # no further pages are requested
+
+
+def first_shard(client, shards):
+  """
+  Returns the position of the first shard holding sessions, or len(shards) if none does,
+  by a binary search over the ranges from the start of the first shard; the empty months
+  before the first session then cost about log2(len(shards)) calls instead of one each.
+  """
+  lo, hi = 0, len(shards)
+  while lo < hi:
+    mid = (lo + hi) // 2
+    if has_sessions(client, shards[0][1], shards[mid][2]):
+      hi = mid
+    else:
+      lo = mid + 1
+  return lo
+
+
+def backfill_sessions(client, shard_dir, logger, start, end, max_workers=2):
+  """
+  Queries the sessions between start and end one month at a time.
+
+  Each completed month is saved to shard_dir together with a manifest entry, so a restarted
+  backfill only queries the months that are missing. The months before the first session
+  are skipped, see first_shard. Up to max_workers months are queried concurrently.
+
+  Returns:
+  pandas.DataFrame: The sessions of all shards, in chronological order.
+  """
+  os.makedirs(shard_dir, exist_ok=True)
+  manifest = ShardManifest(os.path.join(shard_dir, 'manifest.json'))
+
+  shards = list(month_shards(start, end))
+  skipped = first_shard(client, shards)
+  if skipped: logger.info(f'Skipping {skipped} monthly shard(s) before the first session.')
+  shards = shards[skipped:]
+  todo = [shard for shard in shards if not manifest.is_complete(shard[0], shard[2])]
+  logger.info(f'Backfilling {len(todo)} of {len(shards)} monthly shard(s), {len(shards) - len(todo)} already completed.')
+
+  cycle = metrics.current_cycle() # the shards are queried by the executor threads
+
+  def fetch(name, shard_start, shard_end):
+    with metrics.attach(cycle):
+      data = client.queryChargingSession(startTime=shard_start, endTime=shard_end)
+      file = f'{name}.csv' if not data.empty else None
+      if file:
+        schema.to_csv_frame(data, 'sessions').to_csv(os.path.join(shard_dir, file), index=False)
+      manifest.complete(name, shard_end, len(data), file)
+      return name, len(data)
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    futures = [executor.submit(fetch, *shard) for shard in todo]
+    for future in as_completed(futures):
+      name, rows = future.result()
+      if rows: logger.info(f'Shard {name} completed with {rows} row(s).')
+
+  files = [manifest.shards[name]['file'] for name, _, _ in shards if manifest.shards[name]['file']]
+  if not files: return pd.DataFrame()
+  data = schema.concat([schema.read_csv(os.path.join(shard_dir, file), 'sessions') for file in files], 'sessions')
+  return data.drop_duplicates(subset='session_id') # sessions on a shard boundary may appear twice
+
+
+def remove_shards(shard_dir):
+  """Deletes the shard files and manifest once the backfilled data has been saved."""
+  for file in os.listdir(shard_dir):
+    os.remove(os.path.join(shard_dir, file))
+  os.rmdir(shard_dir)
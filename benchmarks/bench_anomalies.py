@@ -0,0 +1,62 @@
+# bench_anomalies.py
+#
+# Measures how the anomaly scan scales with the size of Sessions.csv.
+# Usage: python benchmarks/bench_anomalies.py [--sizes 100000 1000000 10000000] [--legacy-max 100000]
+
+import os, sys, time, argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from anomalies import detect_anomalies
+from synthetic import synthetic_sessions
+
+
+def legacy_scan(sessions):
+  # the original row-by-row implementation, kept here as the baseline
+  anomalies = dict(session_id=[], anomaly_description=[], value=[], unit=[])
+  for i, row in sessions.iterrows():
+    plugged_in_duration = row['total_session_duration']
+    if pd.to_timedelta(plugged_in_duration) / np.timedelta64(1, 'h') >= 24:
+      anomalies['session_id'].append(row['session_id'])
+      anomalies['anomaly_description'].append('User plugged in for longer than 24 hours')
+      anomalies['value'].append(plugged_in_duration)
+      anomalies['unit'].append('hh:mm:ss')
+    plugged_in_time_hours = (row['end_ts'] - row['start_ts']) / 3600
+    power = 0 if plugged_in_time_hours < 0.01 else row['energy'] / plugged_in_time_hours
+    if power > 7:
+      anomalies['session_id'].append(row['session_id'])
+      anomalies['anomaly_description'].append('Charging power exceeds 7 kW')
+      anomalies['value'].append(power)
+      anomalies['unit'].append('kW')
+    charging_duration = row['total_charging_duration']
+    if pd.to_timedelta(charging_duration) / np.timedelta64(1, 'h') >= 12:
+      anomalies['session_id'].append(row['session_id'])
+      anomalies['anomaly_description'].append('User actively charging for longer than 12 hours')
+      anomalies['value'].append(charging_duration)
+      anomalies['unit'].append('hh:mm:ss')
+  return pd.DataFrame(anomalies)
+
+
+def timed(func, *args):
+  t0 = time.perf_counter()
+  result = func(*args)
+  return result, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the anomaly scan on synthetic sessions.')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000])
+  parser.add_argument('--legacy-max', type=int, default=100_000, help='largest size the row-by-row baseline is run on')
+  args = parser.parse_args()
+
+  print(f"{'sessions':>12} {'anomalies':>10} {'vectorized(s)':>14} {'legacy(s)':>10} {'speedup':>8}")
+  for n in args.sizes:
+    sessions = synthetic_sessions(n)
+    result, vectorized = timed(detect_anomalies, sessions)
+    legacy, speedup = '-', '-'
+    if n <= args.legacy_max:
+      expected, seconds = timed(legacy_scan, sessions)
+      assert expected.astype(str).equals(result.astype(str)), 'vectorized scan diverges from the legacy scan'
+      legacy, speedup = f'{seconds:.2f}', f'{seconds / vectorized:.0f}x'
+    print(f'{n:>12} {len(result):>10} {vectorized:>14.2f} {legacy:>10} {speedup:>8}')
@@ -0,0 +1,55 @@
+# bench_stations.py
+#
+# Measures the expansion of station ports into one row per port on a synthetic fleet.
+# Usage: python benchmarks/bench_stations.py [--stations 50000] [--legacy-max 5000]
+
+import os, sys, time, argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ChargePointDatasetUtils import explode_ports
+from synthetic import stations_payload, station_ports
+
+
+def synthetic_fleet(n, ports_per_station=(1, 2, 4), seed=0):
+  return pd.DataFrame(stations_payload(station_ports(n, ports_per_station, seed), seed))
+
+
+def legacy_explode(df_stations):
+  # the original loop, which assumes exactly two ports per station
+  df_stations = df_stations.copy()
+  buf = list()
+  for index, row in df_stations.iterrows():
+    row_copy = row.copy()
+    row.Port = row.Port[0]
+    df_stations.iloc[index] = row
+    row_copy.Port = row_copy.Port[1]
+    buf.append(row_copy)
+  df_new = pd.concat([df_stations, pd.DataFrame(buf)], axis=0).reset_index(drop=True)
+  expanded_port = pd.json_normalize(df_new.Port).drop('Connectors', axis=1)
+  return pd.concat([df_new.drop('Port', axis=1), expanded_port], axis=1)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the station port expansion.')
+  parser.add_argument('--stations', type=int, default=50_000)
+  parser.add_argument('--legacy-max', type=int, default=5_000, help='largest fleet the row-by-row baseline is run on')
+  args = parser.parse_args()
+
+  fleet = synthetic_fleet(args.stations)
+  t0 = time.perf_counter()
+  rows = explode_ports(fleet)
+  print(f'{args.stations} stations (1, 2 or 4 ports): {len(rows)} port rows in {time.perf_counter() - t0:.2f}s')
+
+  # the baseline only handles dual-port stations
+  n = min(args.stations, args.legacy_max)
+  dual = synthetic_fleet(n, ports_per_station=(2,))
+  t0 = time.perf_counter()
+  rows = explode_ports(dual)
+  vectorized = time.perf_counter() - t0
+  t0 = time.perf_counter()
+  expected = legacy_explode(dual)
+  legacy = time.perf_counter() - t0
+  assert expected.astype(str).equals(rows.astype(str)), 'vectorized expansion diverges from the legacy loop'
+  print(f'{n} dual-port stations: {vectorized:.2f}s vectorized, {legacy:.2f}s legacy ({legacy / vectorized:.0f}x)')
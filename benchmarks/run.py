@@ -0,0 +1,143 @@
+# run.py
+#
+# Runs the client, join, scan and worker benchmarks on synthetic data from a fake SOAP
+# service and reports the time and peak traced memory of each.
+# Usage: python benchmarks/run.py [--sessions 100000] [--alarms 20000] [--stations 200]
+#                                 [--latency 0.0] [--save results.json] [--compare results.json]
+
+import os, sys, json, time, shutil, logging, argparse, tempfile, tracemalloc
+from datetime import timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import synthetic
+
+
+def measure(func, memory=True):
+  """
+  Returns the result and seconds of a call, and the peak traced bytes of a second call;
+  tracing slows the code down several times, so it is kept out of the timed call.
+  """
+  t0 = time.perf_counter()
+  result = func()
+  seconds = time.perf_counter() - t0
+  peak = None
+  if memory:
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  return result, seconds, peak
+
+
+def workspace():
+  """Changes into a fresh directory with the repository config, as the workers expect."""
+  path = tempfile.mkdtemp(prefix='evdataset-bench-')
+  shutil.copy(os.path.join(ROOT, 'config.ini'), path)
+  for directory in ('data', 'log'):
+    os.makedirs(os.path.join(path, directory))
+  os.chdir(path)
+  return path
+
+
+def run(args):
+  path = workspace()
+  # the workers read config.ini and resolve their paths when imported
+  import update_worker
+  from anomalies import scan_anomalies
+  from storage import open_store
+
+  logger = logging.getLogger('Benchmark')
+  client = synthetic.fake_client(args.sessions, args.stations, args.alarms, args.days,
+                                 args.latency, args.max_workers, args.seed)
+  end = synthetic.START + timedelta(days=args.days + 1)
+  results = []
+
+  def bench(name, func, rows=None):
+    result, seconds, peak = measure(func, not args.no_memory)
+    count = rows(result) if rows else len(result)
+    results.append({'benchmark': name, 'rows': count, 'seconds': seconds, 'peak_bytes': peak})
+    return result
+
+  sessions = bench('queryChargingSession', lambda: client.queryChargingSession(synthetic.START, end))
+  bench('getStations', client.getStations)
+  alarms = bench('getAlarms', lambda: client.getAlarms(synthetic.START, end))
+  bench('query_session_for_id', lambda: update_worker.query_session_for_id(alarms.copy(), sessions))
+
+  store = open_store('sessions')
+  store.append(sessions)
+  anomaly_path = 'data/Anomalies.csv'
+  bench('scan_anomalies', lambda: scan_anomalies(path, store, anomaly_path, logger),
+        rows=lambda _: store.count())
+
+  # worker cycles merging new_days of new data each into the history stored above
+  cutoff = end - timedelta(days=2 * args.new_days + 1)
+  store.overwrite(sessions[sessions['start_ts'] < int(cutoff.timestamp())])
+  open_store('alarms').append(update_worker.query_session_for_id(
+    alarms[alarms['alarm_ts'] < int(cutoff.timestamp())].copy(), sessions))
+  client.service.until = cutoff
+  session_job, alarm_job = update_worker.update_session_data(client), update_worker.update_alarm_data(client)
+  session_job(), alarm_job() # catches up with the history: first anomaly scan, rollups, caches
+
+  def cycle():
+    client.service.until += timedelta(days=args.new_days) # publishes the next days
+    old_size = store.count()
+    session_job(), alarm_job()
+    return store.count() - old_size
+  bench('worker cycle', cycle, rows=lambda new_rows: new_rows)
+
+  # the workers log their exceptions instead of raising them
+  for log in os.listdir('log'):
+    with open(os.path.join('log', log)) as f:
+      errors = [line.strip() for line in f if ' - ERROR - ' in line]
+    if errors: raise RuntimeError(f'{log}: {errors[0]}')
+
+  os.chdir(ROOT)
+  shutil.rmtree(path, ignore_errors=True)
+  return results
+
+
+def report(results, baseline=None, tolerance=1.25):
+  """Prints the results; returns the names of the benchmarks slower than the baseline."""
+  previous = {r['benchmark']: r for r in baseline or []}
+  regressions = []
+  print(f"{'benchmark':<22} {'rows':>10} {'seconds':>9} {'peak MB':>9} {'vs base':>8}")
+  for r in results:
+    peak = '-' if r['peak_bytes'] is None else f"{r['peak_bytes'] / 2 ** 20:.1f}"
+    ratio = '-'
+    if r['benchmark'] in previous:
+      change = r['seconds'] / max(previous[r['benchmark']]['seconds'], 1e-9)
+      ratio = f'{change:.2f}x'
+      if change > tolerance: regressions.append(r['benchmark'])
+    print(f"{r['benchmark']:<22} {r['rows']:>10} {r['seconds']:>9.3f} {peak:>9} {ratio:>8}")
+  return regressions
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the client, join, scan and worker cycle on synthetic data.')
+  parser.add_argument('--sessions', type=int, default=100_000)
+  parser.add_argument('--alarms', type=int, default=20_000)
+  parser.add_argument('--stations', type=int, default=200)
+  parser.add_argument('--days', type=int, default=365, help='time span of the synthetic data')
+  parser.add_argument('--new-days', type=int, default=1, help='days of new data fetched by the worker cycle')
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake API call')
+  parser.add_argument('--max-workers', type=int, default=4, help='pages requested concurrently by the client')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows down the timed code')
+  parser.add_argument('--save', help='write the results to this JSON file')
+  parser.add_argument('--compare', help='JSON file of earlier results; exits with 1 if a benchmark got slower')
+  parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown factor reported as a regression')
+  args = parser.parse_args()
+
+  results = run(args)
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  regressions = report(results, baseline, args.tolerance)
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(results, f, indent=2)
+  if regressions:
+    print(f"Slower than the baseline: {', '.join(regressions)}")
+    sys.exit(1)
@@ -0,0 +1,180 @@
+# synthetic.py
+#
+# Seeded synthetic ChargePoint payloads and an in-process fake of the SOAP service,
+# so the client, the workers and the scans can be measured without API credentials.
+
+import os, sys, time
+from datetime import datetime, timedelta
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ChargePointApiClient import ChargePointApiClient
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+START = datetime(2023, 1, 1, tzinfo=pytz.UTC)
+ALARM_TYPES = ['Unreachable', 'Reachable', 'GFCI Trip', 'Circuit Sharing Current Reduced', 'Port Faulted']
+
+
+def hms(seconds):
+  """Formats durations in seconds as the API does, e.g. 27:05:09."""
+  return [f'{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}' for s in seconds]
+
+
+def to_datetimes(ts):
+  return [EPOCH + timedelta(seconds=int(s)) for s in ts]
+
+
+def utc(dt):
+  """The workers query with naive UTC datetimes."""
+  return dt.replace(tzinfo=pytz.UTC) if dt is not None and dt.tzinfo is None else dt
+
+
+def station_ports(n_stations, ports_per_station=(2,), seed=0):
+  """Returns the number of ports of every station."""
+  return np.random.default_rng(seed).choice(ports_per_station, n_stations)
+
+
+def stations_payload(n_ports, seed=0):
+  """Returns the stationData records of getStations for stations with the given port counts."""
+  rng = np.random.default_rng(seed)
+  stations = []
+  for i, ports in enumerate(n_ports):
+    stations.append({
+      'stationID': f'1:{i}', 'orgID': '1:ORG', 'sgID': '1, 2', 'stationModel': 'CT4020-HD',
+      'stationActivationDate': START - timedelta(days=int(rng.integers(30, 2000))),
+      'timezoneOffset': '-08:00',
+      'Port': [{
+        'portNumber': str(p + 1), 'Reservable': 0, 'Status': 'AVAILABLE', 'Level': 'L2',
+        'timeStamp': None, 'Mode': 1, 'Connector': 'J1772', 'Voltage': '240', 'Current': '30',
+        'Power': '6.6', 'estimatedCost': 0,
+        'Geo': {'Lat': f'{49 + rng.random():.6f}', 'Long': f'{-123 + rng.random():.6f}'},
+        'Connectors': [{'Connector': 'J1772', 'Status': 'AVAILABLE'}],
+      } for p in range(ports)],
+      'Address': f'{i} University Dr', 'stationManufacturer': 'ChargePoint',
+      'stationName': f'SFU / STATION {i}', 'Description': '',
+    })
+  return stations
+
+
+def sessions_payload(n, n_ports, days=365, users=None, seed=0):
+  """
+  Returns the ChargingSessionData records of n sessions on the given stations, ordered by
+  start time over `days` days. Durations follow a gamma distribution, so a few sessions
+  trigger the anomaly rules.
+  """
+  rng = np.random.default_rng(seed)
+  users = users or max(n // 20, 1)
+  station = rng.integers(0, len(n_ports), n)
+  port = (rng.random(n) * np.asarray(n_ports)[station]).astype(np.int64) + 1
+  start_ts = np.sort(rng.integers(0, days * 86400, n)) + int(START.timestamp())
+  session_seconds = rng.gamma(2.0, 2 * 3600, n).astype(np.int64) + 60
+  charging_seconds = (session_seconds * rng.random(n)).astype(np.int64)
+  energy = rng.gamma(2.0, 4.0, n)
+  return [{
+    'sessionID': 100_000_000 + i, 'userID': int(u), 'credentialID': f'CRED{u}',
+    'stationID': f'1:{s}', 'portNumber': str(p), 'startTime': st, 'endTime': en,
+    'Energy': Decimal(f'{e:.6f}'), 'totalChargingDuration': cd, 'totalSessionDuration': sd,
+    'Address': f'{s} University Dr',
+  } for i, (u, s, p, st, en, e, cd, sd) in enumerate(zip(
+    rng.integers(1, users + 1, n), station, port, to_datetimes(start_ts),
+    to_datetimes(start_ts + session_seconds), energy, hms(charging_seconds), hms(session_seconds)))]
+
+
+def alarms_payload(n, n_ports, days=365, seed=0):
+  """Returns the Alarms records of getAlarms, ordered by alarm time."""
+  rng = np.random.default_rng(seed)
+  station = rng.integers(0, len(n_ports), n)
+  port = (rng.random(n) * np.asarray(n_ports)[station]).astype(np.int64) + 1
+  alarm_ts = np.sort(rng.integers(0, days * 86400, n)) + int(START.timestamp())
+  return [{
+    'stationID': f'1:{s}', 'stationName': f'SFU / STATION {s}', 'stationModel': 'CT4020-HD',
+    'orgID': '1:ORG', 'portNumber': str(p), 'alarmType': ALARM_TYPES[t], 'alarmTime': at,
+  } for s, p, t, at in zip(station, port, rng.integers(0, len(ALARM_TYPES), n), to_datetimes(alarm_ts))]
+
+
+def synthetic_sessions(n, seed=0):
+  """Returns n sessions with the columns read by the anomaly scan, as stored on disk."""
+  rng = np.random.default_rng(seed)
+  start_ts = rng.integers(1_500_000_000, 1_700_000_000, n)
+  session_seconds = rng.gamma(2.0, 3 * 3600, n).astype(np.int64)
+  charging_seconds = (session_seconds * rng.random(n)).astype(np.int64)
+
+  # durations are drawn from a pool of pre-formatted strings to keep generation cheap
+  pool = np.arange(0, 72 * 3600, 7)
+  pool_str = np.array([f'{s // 3600}:{s % 3600 // 60:02d}:{s % 60:02d}' for s in pool], dtype=object)
+  return pd.DataFrame({
+    'session_id': np.arange(n, dtype=np.int64) + 100_000_000,
+    'start_ts': start_ts,
+    'end_ts': start_ts + session_seconds,
+    'energy': rng.gamma(2.0, 5.0, n).round(6),
+    'total_charging_duration': pool_str[np.minimum(charging_seconds // 7, len(pool) - 1)],
+    'total_session_duration': pool_str[np.minimum(session_seconds // 7, len(pool) - 1)],
+  })
+
+
+class FakeChargePointService:
+  """
+  Serves synthetic records like the ChargePoint SOAP service: time ranges are filtered,
+  pages hold record_limit records starting at startRecord (1-based), and the more flag
+  tells whether another page follows. `latency` seconds are added to every call.
+  """
+
+  def __init__(self, sessions=(), stations=(), alarms=(), record_limit=100, latency=0.0):
+    self.sessions = list(sessions)
+    self.session_starts = np.array([s['startTime'] for s in self.sessions], dtype=object)
+    self.stations = list(stations)
+    self.alarms = list(alarms)
+    self.alarm_times = np.array([a['alarmTime'] for a in self.alarms], dtype=object)
+    self.record_limit = record_limit
+    self.latency = latency
+    self.until = None # records after this time are not published yet
+    self.calls = 0
+
+  def _page(self, records, times, first, last, startRecord):
+    self.calls += 1
+    if self.latency: time.sleep(self.latency)
+    first, last = utc(first), utc(last)
+    if self.until is not None: last = self.until if last is None else min(last, self.until)
+    lo = np.searchsorted(times, first, side='left') if first is not None else 0
+    hi = np.searchsorted(times, last, side='right') if last is not None else len(records)
+    begin = lo + startRecord - 1
+    page = records[begin:min(begin + self.record_limit, hi)]
+    return page, int(begin + self.record_limit < hi)
+
+  def getChargingSessionData(self, searchQuery):
+    page, more = self._page(self.sessions, self.session_starts, searchQuery.get('fromTimeStamp'),
+                            searchQuery.get('toTimeStamp'), searchQuery.get('startRecord', 1))
+    return {'ChargingSessionData': page or None, 'MoreFlag': more}
+
+  def getAlarms(self, searchQuery):
+    page, more = self._page(self.alarms, self.alarm_times, searchQuery.get('startTime'),
+                            searchQuery.get('endTime'), searchQuery.get('startRecord', 1))
+    return {'Alarms': page or None, 'moreFlag': more}
+
+  def getStations(self, searchQuery={}):
+    self.calls += 1
+    if self.latency: time.sleep(self.latency)
+    return {'stationData': self.stations}
+
+
+class FakeChargePointApiClient(ChargePointApiClient):
+  """The API client talking to a FakeChargePointService instead of the SOAP endpoint."""
+
+  def __init__(self, service, **kwargs):
+    self.service = service
+    super().__init__(None, None, **kwargs)
+
+  def getApiServiceImpl(self, api_key, api_secret, transport=None, wsdl_url=None):
+    return self.service
+
+
+def fake_client(sessions=1000, stations=50, alarms=500, days=365, latency=0.0, max_workers=4, seed=0):
+  """Returns a client of a fake service holding the given number of synthetic records, see client.service."""
+  n_ports = station_ports(stations, seed=seed)
+  service = FakeChargePointService(sessions_payload(sessions, n_ports, days, seed=seed),
+                                   stations_payload(n_ports, seed=seed),
+                                   alarms_payload(alarms, n_ports, days, seed=seed), latency=latency)
+  return FakeChargePointApiClient(service, max_workers=max_workers)
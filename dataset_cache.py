@@ -0,0 +1,99 @@
+# dataset_cache.py
+
+import threading
+import pandas as pd
+import schema
+from storage import open_store, filter_range
+
+
+class DatasetCache:
+  """
+  A store whose rows are also kept in memory, so the workers of a process parse a dataset
+  once instead of on every read.
+
+  It has the interface of the stores it wraps. Rows appended through the cache are added to
+  the cached frame as well; any other change of the files, e.g. a compaction or another
+  process, is noticed by comparing the store version and the frame is read again. The
+  cached frame is replaced rather than modified, so frames already returned to other
+  threads stay valid; they are shared and must not be modified in place.
+  """
+
+  def __init__(self, store):
+    self.store = store
+    self.lock = store.lock # shared with the store, appends and reads never interleave
+    self.frame = None
+    self.version = None
+
+  def get(self, columns=None):
+    """Returns the cached rows, reading the store if it changed since they were cached."""
+    with self.lock:
+      version = self.store.version()
+      if self.frame is None or version != self.version:
+        self.frame = self.store.read()
+        self.version = version
+      frame = self.frame
+    return frame.copy(deep=False) if columns is None else self._select(frame, columns)
+
+  def read(self, columns=None, start=None, end=None):
+    """Reads the given columns of the rows whose partition column lies in [start, end]."""
+    df = filter_range(self.get(), self.store.partition_column, start, end)
+    return df if columns is None else self._select(df, columns)
+
+  def _select(self, df, columns):
+    # an empty store has no columns; return the requested ones, typed, as the stores do
+    if df.empty: return schema.enforce(pd.DataFrame(columns=columns), self.store.table)
+    return df[columns]
+
+  def exists(self):
+    return self.store.exists()
+
+  def count(self):
+    return len(self.get(columns=[]))
+
+  def max(self, column):
+    values = self.get(columns=[column])[column]
+    return None if values.empty else values.max()
+
+  def append(self, df):
+    if df.empty: return
+    with self.lock:
+      cached = self.frame is not None and self.store.version() == self.version
+      self.store.append(df)
+      if cached:
+        new_rows = schema.enforce(df, self.store.table).reset_index(drop=True)
+        if len(self.frame.columns): # the columns of the stored rows come first, as in the store
+          self.frame = schema.concat([self.frame, new_rows.reindex(columns=self.frame.columns)], self.store.table)
+        else:
+          self.frame = new_rows
+        self.version = self.store.version()
+
+  def overwrite(self, df):
+    with self.lock:
+      self.store.overwrite(df)
+      self.invalidate()
+
+  def invalidate(self):
+    with self.lock:
+      self.frame, self.version = None, None
+
+  def compact(self):
+    self.store.compact() # changes the version, the rows are read again when needed
+
+  def compact_if_due(self, frequency):
+    self.store.compact_if_due(frequency)
+
+  def export_csv(self, path):
+    self.store.export_csv(path)
+
+
+# one cache per dataset, shared by all worker threads of the process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cached(name):
+  """Returns the process-wide cache of a dataset ('sessions', 'alarms' or 'stations')."""
+  with _caches_lock:
+    if name not in _caches:
+      _caches[name] = DatasetCache(open_store(name))
+    return _caches[name]
@@ -0,0 +1,61 @@
+# interval_join.py
+
+import numpy as np
+import pandas as pd
+
+
+class SessionIntervalIndex:
+  """
+  Finds the session that is in progress at a given time on a given station port.
+
+  Sessions are grouped by their key columns and sorted by start time, so each lookup is a
+  binary search instead of a scan over all sessions. A timestamp matches a session when
+  start < timestamp < end; if several sessions match, the one that comes first in the
+  original frame is returned, like a boolean-mask filter followed by iloc[0] would.
+  """
+
+  def __init__(self, sessions, key_columns=('station_id', 'port_no'), start='start_ts', end='end_ts'):
+    self.key_columns = list(key_columns)
+    self.groups = {}
+    keys = normalize_keys(sessions, self.key_columns)
+    starts = pd.to_numeric(sessions[start]).to_numpy()
+    ends = pd.to_numeric(sessions[end]).to_numpy()
+    for key, positions in keys.groupby(self.key_columns, sort=False).indices.items():
+      order = positions[np.argsort(starts[positions], kind='stable')]
+      group_ends = ends[order]
+      self.groups[key] = (starts[order], group_ends, np.maximum.accumulate(group_ends), order)
+
+  def lookup(self, df, ts):
+    """
+    Returns, for every row of df, the position in the sessions frame of the session that
+    contains df[ts] on the same key, or -1 if there is none.
+    """
+    result = np.full(len(df), -1, dtype=np.int64)
+    if df.empty or not self.groups: return result
+    keys = normalize_keys(df, self.key_columns)
+    times = pd.to_numeric(df[ts]).to_numpy()
+    for key, rows in keys.groupby(self.key_columns, sort=False).indices.items():
+      if key not in self.groups: continue
+      starts, ends, max_ends, order = self.groups[key]
+      t = times[rows]
+      k = np.searchsorted(starts, t, side='left') # sessions [0, k) start before t
+      last = np.maximum(k - 1, 0)
+      found = (k > 0) & (ends[last] > t)
+      result[rows[found]] = order[last[found]]
+
+      # an earlier session may also contain t when sessions of this key overlap
+      earlier = np.maximum(k - 2, 0)
+      ambiguous = np.nonzero((k > 1) & (max_ends[earlier] > t))[0]
+      for i in ambiguous:
+        matches = order[:k[i]][ends[:k[i]] > t[i]]
+        result[rows[i]] = matches.min() if len(matches) else -1
+    return result
+
+
+def normalize_keys(df, key_columns):
+  """Casts numeric key columns to float so that e.g. float16 and int port numbers compare equal."""
+  keys = df[key_columns].reset_index(drop=True)
+  for column in key_columns:
+    if pd.api.types.is_numeric_dtype(keys[column]):
+      keys[column] = keys[column].astype(np.float64)
+  return keys
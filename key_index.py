@@ -0,0 +1,85 @@
+# key_index.py
+
+import os, sqlite3, threading
+import pandas as pd
+from schema import SCHEMAS
+
+# columns that identify a row of each dataset; alarms of different stations, ports
+# or types may share the same second
+KEY_COLUMNS = {
+  'sessions': ['session_id'],
+  'alarms': ['station_id', 'port_no', 'alarm_type', 'alarm_ts'],
+}
+
+
+def make_keys(df, name):
+  """Builds the key of every row as a string, e.g. 'a1b2c3d4e5|1|Unreachable|1690000000'."""
+  dtypes = SCHEMAS[name]
+  parts = []
+  for column in KEY_COLUMNS[name]:
+    values = df[column]
+    if dtypes.get(column, 'category') != 'category': # numbers are formatted the same way whether they come from the API or from disk
+      values = pd.to_numeric(values, errors='coerce').astype('Int64')
+    parts.append(values.astype(str))
+  keys = parts[0]
+  for part in parts[1:]:
+    keys = keys + '|' + part
+  return keys.reset_index(drop=True)
+
+
+class KeyIndex:
+  """
+  The keys of the stored rows of a dataset, kept in a SQLite sidecar file.
+
+  Incoming rows are checked against the index in O(batch) lookups instead of
+  de-duplicating them against the whole history.
+  """
+
+  def __init__(self, path, name):
+    self.path = path
+    self.name = name
+    self.lock = threading.Lock()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.conn = sqlite3.connect(path, check_same_thread=False)
+    self.conn.execute('CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY) WITHOUT ROWID')
+
+  def __len__(self):
+    with self.lock:
+      return self.conn.execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+  def contains(self, keys):
+    """Returns a boolean array telling which of the keys are already indexed."""
+    found = set()
+    with self.lock:
+      for i in range(0, len(keys), 500): # stay below the SQLite parameter limit
+        chunk = list(keys[i:i + 500])
+        query = 'SELECT key FROM keys WHERE key IN ({})'.format(','.join('?' * len(chunk)))
+        found.update(row[0] for row in self.conn.execute(query, chunk))
+    return keys.isin(found).to_numpy()
+
+  def filter_new(self, df):
+    """Returns the rows of df whose key is neither indexed nor repeated within df."""
+    if df.empty: return df
+    keys = make_keys(df, self.name)
+    new = ~self.contains(keys) & ~keys.duplicated().to_numpy()
+    return df[new]
+
+  def add(self, df):
+    if df.empty: return
+    keys = make_keys(df, self.name)
+    with self.lock, self.conn:
+      self.conn.executemany('INSERT OR IGNORE INTO keys VALUES (?)', ((key,) for key in keys))
+
+  def rebuild(self, store):
+    """Re-indexes every row of the store, e.g. when the sidecar file was lost."""
+    with self.lock, self.conn:
+      self.conn.execute('DELETE FROM keys')
+    self.add(store.read(columns=KEY_COLUMNS[self.name]))
+
+
+def open_index(name, store, index_root):
+  """Opens the key index of a dataset, rebuilding it if it is out of sync with the store."""
+  index = KeyIndex(os.path.join(index_root, f'{name}.sqlite'), name)
+  if len(index) != store.count():
+    index.rebuild(store)
+  return index
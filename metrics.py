@@ -0,0 +1,211 @@
+# metrics.py
+
+import os, sys, json, time, resource, threading
+from collections import defaultdict
+from contextlib import contextmanager
+from ChargePointDatasetUtils import atomic_write
+
+PREFIX = 'evdataset'
+
+HELP = {
+  'stage_seconds': ('summary', 'Wall time of a stage of a worker cycle.'),
+  'stage_rows_total': ('counter', 'Rows processed by a stage of a worker cycle.'),
+  'cycle_seconds': ('summary', 'Wall time of a worker cycle.'),
+  'cycles_total': ('counter', 'Worker cycles run, by status.'),
+  'last_cycle_seconds': ('gauge', 'Wall time of the last worker cycle.'),
+  'last_cycle_timestamp_seconds': ('gauge', 'End time of the last worker cycle.'),
+  'api_pages_total': ('counter', 'API pages or calls received.'),
+  'api_records_total': ('counter', 'API records received.'),
+  'api_page_seconds': ('summary', 'Latency of an API call, including retries.'),
+  'api_retries_total': ('counter', 'API calls retried after a transient failure.'),
+  'peak_rss_bytes': ('gauge', 'Peak resident set size of the process.'),
+}
+
+
+def peak_rss_bytes():
+  usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return usage if sys.platform == 'darwin' else usage * 1024 # kilobytes on Linux
+
+
+def format_value(value):
+  return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Stage:
+  """Handed out by Metrics.stage; set rows to the number of rows the stage processed."""
+  __slots__ = ('rows',)
+
+  def __init__(self):
+    self.rows = None
+
+
+class Metrics:
+  """
+  Counters, summaries and gauges of the worker process, shared by all threads.
+
+  A worker cycle runs inside cycle(job); the stages it runs inside stage(name) are timed
+  and attributed to the cycle of the calling thread, as are its API pages; a thread started
+  by a cycle runs inside attach(cycle) to count towards it. At the end of a cycle one JSON line
+  with its stages, API pages and peak RSS is appended to json_path, and all metrics are
+  written to prometheus_path in the Prometheus text format, e.g. for the node exporter's
+  textfile collector. Nothing is written until configure() was called.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counters = defaultdict(float)
+    self.summaries = defaultdict(lambda: [0, 0.0, 0.0]) # count, sum, max
+    self.gauges = {}
+    self.local = threading.local()
+    self.json_path = None
+    self.prometheus_path = None
+
+  def configure(self, json_path=None, prometheus_path=None):
+    self.json_path = json_path
+    self.prometheus_path = prometheus_path
+    for path in (json_path, prometheus_path):
+      if path: os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+  def inc(self, name, value=1, **labels):
+    with self.lock:
+      self.counters[name, tuple(sorted(labels.items()))] += value
+
+  def observe(self, name, value, **labels):
+    with self.lock:
+      summary = self.summaries[name, tuple(sorted(labels.items()))]
+      summary[0] += 1
+      summary[1] += value
+      summary[2] = max(summary[2], value)
+
+  def set(self, name, value, **labels):
+    with self.lock:
+      self.gauges[name, tuple(sorted(labels.items()))] = value
+
+  def current_cycle(self):
+    """Returns the cycle of the calling thread, to attach to the threads it starts."""
+    return getattr(self.local, 'cycle', None)
+
+  @contextmanager
+  def attach(self, cycle):
+    """Attributes the stages and API pages of the calling thread to cycle, e.g. in an executor thread."""
+    previous = self.current_cycle()
+    self.local.cycle = cycle
+    try:
+      yield
+    finally:
+      self.local.cycle = previous
+
+  def observe_page(self, operation, seconds, records):
+    """Records an API call that returned a page of records."""
+    self.inc('api_pages_total', operation=operation)
+    self.inc('api_records_total', records, operation=operation)
+    self.observe('api_page_seconds', seconds, operation=operation)
+    current = self.current_cycle()
+    if current is not None:
+      with self.lock: # the pages of one cycle may be fetched by several threads
+        totals = current['api'].setdefault(operation, {'pages': 0, 'records': 0, 'seconds': 0.0})
+        totals['pages'] += 1
+        totals['records'] += records
+        totals['seconds'] += seconds
+
+  @contextmanager
+  def stage(self, name):
+    current = self.current_cycle()
+    labels = {'job': current['job'], 'stage': name} if current else {'stage': name}
+    stage = Stage()
+    t0 = time.perf_counter()
+    try:
+      yield stage
+    finally:
+      seconds = time.perf_counter() - t0
+      self.observe('stage_seconds', seconds, **labels)
+      if stage.rows is not None:
+        self.inc('stage_rows_total', stage.rows, **labels)
+      if current is not None: # a stage may run several times per cycle, e.g. once per batch or thread
+        with self.lock:
+          totals = current['stages'].setdefault(name, {'seconds': 0.0, 'rows': 0})
+          totals['seconds'] += seconds
+          totals['rows'] += stage.rows or 0
+
+  def error(self):
+    """Marks the cycle of the calling thread as failed."""
+    current = self.current_cycle()
+    if current is not None: current['status'] = 'failed'
+
+  @contextmanager
+  def cycle(self, job):
+    self.local.cycle = current = {'job': job, 'status': 'ok', 'stages': {}, 'api': {}}
+    started, t0 = time.time(), time.perf_counter()
+    try:
+      yield
+    except Exception:
+      current['status'] = 'failed'
+      raise
+    finally:
+      self.local.cycle = None
+      seconds = time.perf_counter() - t0
+      self.observe('cycle_seconds', seconds, job=job)
+      self.inc('cycles_total', job=job, status=current['status'])
+      self.set('last_cycle_seconds', seconds, job=job)
+      self.set('last_cycle_timestamp_seconds', time.time(), job=job)
+      self.set('peak_rss_bytes', peak_rss_bytes())
+
+      api = current['api']
+      for totals in api.values():
+        totals['mean_latency'] = round(totals['seconds'] / totals['pages'], 6)
+        totals['seconds'] = round(totals['seconds'], 6)
+      for totals in current['stages'].values():
+        totals['seconds'] = round(totals['seconds'], 6)
+
+      self._write_json({'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)), 'job': job,
+                        'status': current['status'], 'seconds': round(seconds, 6), 'stages': current['stages'],
+                        'api': api, 'peak_rss_bytes': peak_rss_bytes()})
+      self.write_prometheus()
+
+  def timed(self, job, func):
+    """Returns func running inside cycle(job)."""
+    def run(*args, **kwargs):
+      with self.cycle(job):
+        return func(*args, **kwargs)
+    return run
+
+  def _write_json(self, line):
+    if not self.json_path: return
+    with self.lock, open(self.json_path, 'a') as f:
+      f.write(json.dumps(line) + '\n')
+
+  def write_prometheus(self):
+    if not self.prometheus_path: return
+    with self.lock:
+      samples = defaultdict(list)
+      for (name, labels), value in self.counters.items():
+        samples[name].append(('', labels, value))
+      for (name, labels), value in self.gauges.items():
+        samples[name].append(('', labels, value))
+      for (name, labels), (count, total, maximum) in self.summaries.items():
+        samples[name] += [('_count', labels, count), ('_sum', labels, total)]
+        samples[name + '_max'].append(('', labels, maximum))
+
+    lines = []
+    for name in sorted(samples):
+      kind, text = HELP.get(name) or ('gauge', f'Largest observed value of {PREFIX}_{name[:-len("_max")]}.')
+      lines.append(f'# HELP {PREFIX}_{name} {text}')
+      lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+      for suffix, labels, value in sorted(samples[name], key=lambda s: (s[1], s[0])):
+        label_text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+        lines.append(f'{PREFIX}_{name}{suffix}' + (f'{{{label_text}}}' if label_text else '') + f' {format_value(value)}')
+    with atomic_write(self.prometheus_path) as tmp, open(tmp, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+
+
+# the metrics of this process
+registry = Metrics()
+configure = registry.configure
+stage = registry.stage
+cycle = registry.cycle
+timed = registry.timed
+error = registry.error
+observe_page = registry.observe_page
+current_cycle = registry.current_cycle
+attach = registry.attach
+inc = registry.inc
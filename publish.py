@@ -0,0 +1,138 @@
+# publish.py
+
+import os, json, glob, hashlib, configparser
+import pandas as pd
+import schema
+from storage import DATASETS, open_store, month_of
+from ChargePointDatasetUtils import atomic_write
+
+cwd = os.getcwd()
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# file suffix -> writer; csv is gzipped without a timestamp, so unchanged data gives the same bytes.
+# csv files have the layout of the exported CSV files, parquet files keep the types of the schema
+FORMATS = {
+  'csv.gz': lambda df, path, table: schema.to_csv_frame(df, table).to_csv(path, index=False, compression={'method': 'gzip', 'mtime': 0}),
+  'parquet': lambda df, path, table: df.to_parquet(path, index=False, compression='zstd'),
+}
+
+
+def fingerprint(df):
+  """Hashes the content of a frame, used to skip the months that did not change."""
+  digest = hashlib.blake2b(','.join(df.columns).encode(), digest_size=16)
+  digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+  return digest.hexdigest()
+
+
+def file_sha256(path):
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def write_artifacts(df, directory, stem, formats, table=None):
+  """Writes df, rows of a table of schema.SCHEMAS, in every format; returns the index entries of the files."""
+  files = {}
+  for suffix in formats:
+    name = f'{stem}.{suffix}'
+    path = os.path.join(directory, name)
+    with atomic_write(path) as tmp:
+      FORMATS[suffix](df, tmp, table)
+    files[suffix] = {'path': name, 'bytes': os.path.getsize(path), 'sha256': file_sha256(path)}
+  return files
+
+
+def publish_dataset(name, df, root, formats, previous=None, partition_column=None):
+  """
+  Writes a dataset as compressed files, one per month of partition_column, or a single
+  file if there is no partition column. Months whose content and formats are unchanged
+  since the previous index entry are not written again.
+
+  Parameters:
+  name (str): The dataset name, used for the directory and the file names.
+  df (pandas.DataFrame): The rows of the dataset.
+  root (str): The publish directory.
+  formats (list): Suffixes of FORMATS to write.
+  previous (dict): The index entry of the dataset from the previous publish.
+  partition_column (str): The epoch seconds column the months are taken from.
+
+  Returns:
+  tuple: The new index entry of the dataset and the number of files written.
+  """
+  directory = os.path.join(root, name)
+  os.makedirs(directory, exist_ok=True)
+  old_parts = (previous or {}).get('partitions', {})
+
+  if partition_column and not df.empty:
+    months = month_of(pd.to_numeric(df[partition_column]))
+    groups = {month: df[months == month] for month in sorted(pd.unique(months))}
+  else:
+    groups = {'all': df}
+
+  partitions, written = {}, 0
+  for key, part in groups.items():
+    stem = name if key == 'all' else f'{name}-{key}'
+    entry = {'rows': len(part), 'fingerprint': fingerprint(part)}
+    if partition_column and not part.empty:
+      ts = pd.to_numeric(part[partition_column])
+      entry['min_ts'], entry['max_ts'] = int(ts.min()), int(ts.max())
+    old = old_parts.get(key)
+    if (old and old['fingerprint'] == entry['fingerprint'] and sorted(old['files']) == sorted(formats)
+        and all(os.path.exists(os.path.join(directory, f['path'])) for f in old['files'].values())):
+      entry['files'] = old['files']
+    else:
+      entry['files'] = write_artifacts(part, directory, stem, formats, name)
+      written += len(formats)
+    partitions[key] = entry
+
+  # remove the files of months or formats that are gone
+  current = {f['path'] for entry in partitions.values() for f in entry['files'].values()}
+  for path in glob.glob(os.path.join(directory, f'{name}*')):
+    if os.path.basename(path) not in current:
+      os.remove(path)
+
+  columns = {column: str(dtype) for column, dtype in df.dtypes.items()}
+  return {'partition_column': partition_column, 'columns': columns, 'rows': len(df), 'partitions': partitions}, written
+
+
+def publish_all(root=None, formats=None, logger=None):
+  """
+  Publishes the stored datasets and the anomalies under root, with an index.json listing
+  the rows, time range, size and checksum of every file, so consumers can download only
+  the months they need.
+  """
+  root = root or os.path.join(cwd, config.get('Publish', 'root'))
+  formats = formats or [suffix.strip() for suffix in config.get('Publish', 'formats').split(',')]
+  index_path = os.path.join(root, 'index.json')
+  index = {}
+  if os.path.exists(index_path):
+    with open(index_path) as f:
+      index = json.load(f)
+  datasets = index.get('datasets', {})
+
+  sources = []
+  for name, (_, partition_column) in DATASETS.items():
+    store = open_store(name)
+    if store.exists():
+      sources.append((name, store.read(), partition_column))
+  anomaly_path = os.path.join(cwd, config.get('Paths', 'anomaly_data_path'))
+  if os.path.exists(anomaly_path) and os.path.getsize(anomaly_path) > 0:
+    sources.append(('anomalies', pd.read_csv(anomaly_path), None))
+
+  for name, df, partition_column in sources:
+    datasets[name], written = publish_dataset(name, df, root, formats, datasets.get(name), partition_column)
+    if logger: logger.info(f"Published {name}: {written} file(s) written.")
+
+  index = {'formats': formats, 'datasets': datasets}
+  os.makedirs(root, exist_ok=True)
+  with atomic_write(index_path) as tmp, open(tmp, 'w') as f:
+    json.dump(index, f, indent=2)
+  return index
+
+
+if __name__ == '__main__':
+  # python publish.py rebuilds the published files on demand
+  publish_all()
@@ -0,0 +1,194 @@
+# rollups.py
+
+import os, glob, shutil
+import numpy as np
+import pandas as pd
+from anomalies import detect_anomalies, duration_hours, read_watermark, write_watermark, rules_signature
+from storage import month_of, filter_range
+from ChargePointDatasetUtils import atomic_write
+
+# bucket length in seconds of every rollup table
+GRAINS = {'hourly': 3600, 'daily': 86400}
+
+KEY_COLUMNS = ['station_id', 'port_no', 'bucket_ts']
+VALUE_COLUMNS = ['sessions', 'energy', 'occupied_minutes', 'charging_minutes', 'anomalies']
+
+# the session columns read from storage to build the rollups
+ROLLUP_COLUMNS = ['session_id', 'station_id', 'port_no', 'start_ts', 'end_ts', 'energy',
+                  'total_charging_duration', 'total_session_duration']
+
+
+def aggregate(sessions, seconds):
+  """
+  Aggregates sessions into buckets of `seconds` per station port.
+
+  A session is counted, with its anomalies, in the bucket it starts in. Its plugged-in
+  time is split over the buckets it overlaps; its energy and charging time are split in
+  the same proportions, as the API does not tell when within a session the car charged.
+  Bucket start times are UTC epoch seconds.
+  """
+  if sessions.empty: return pd.DataFrame(columns=KEY_COLUMNS + VALUE_COLUMNS)
+  start = sessions['start_ts'].to_numpy(dtype=np.int64)
+  end = np.maximum(sessions['end_ts'].to_numpy(dtype=np.int64), start)
+
+  # one row per session and overlapped bucket
+  first = start // seconds
+  spans = np.maximum(end - 1, start) // seconds - first + 1
+  rows = np.repeat(np.arange(len(sessions)), spans)
+  offsets = np.arange(len(rows)) - np.repeat(np.cumsum(spans) - spans, spans)
+  bucket = (first[rows] + offsets) * seconds
+  overlap = np.minimum(end[rows], bucket + seconds) - np.maximum(start[rows], bucket)
+  duration = (end - start)[rows]
+  share = np.where(duration > 0, overlap / np.maximum(duration, 1), 1.0)
+  starts_here = offsets == 0
+
+  anomalies = detect_anomalies(sessions)
+  anomaly_counts = sessions['session_id'].map(anomalies['session_id'].value_counts()).fillna(0).to_numpy()
+  charging_minutes = duration_hours(sessions['total_charging_duration']).to_numpy() * 60
+
+  df = pd.DataFrame({
+    'station_id': sessions['station_id'].to_numpy()[rows],
+    'port_no': sessions['port_no'].astype('Int64').to_numpy()[rows],
+    'bucket_ts': bucket,
+    'sessions': starts_here.astype(np.int64),
+    'energy': sessions['energy'].to_numpy(dtype=np.float64)[rows] * share,
+    'occupied_minutes': overlap / 60,
+    'charging_minutes': charging_minutes[rows] * share,
+    'anomalies': np.where(starts_here, anomaly_counts[rows], 0).astype(np.int64),
+  })
+  return merge([df])
+
+
+def merge(frames):
+  """Sums the rows of rollup frames that share a key."""
+  df = pd.concat(frames, ignore_index=True)
+  df['port_no'] = df['port_no'].astype('Int64')
+  return df.groupby(KEY_COLUMNS, as_index=False, dropna=False, sort=True)[VALUE_COLUMNS].sum()
+
+
+class RollupTable:
+  """A rollup table kept as one parquet file per month of bucket_ts."""
+
+  def __init__(self, path, seconds):
+    self.path = path
+    self.seconds = seconds
+
+  def _file(self, month):
+    return os.path.join(self.path, f'month={month}.parquet')
+
+  def replace(self, df):
+    """Writes aggregated rows; the files of the months they fall in are replaced with them."""
+    if df.empty: return
+    os.makedirs(self.path, exist_ok=True)
+    months = month_of(df['bucket_ts'])
+    for month in pd.unique(months):
+      path = self._file(month)
+      with atomic_write(path) as tmp:
+        merge([df[months == month]]).to_parquet(tmp, index=False)
+
+  def read(self, start=None, end=None):
+    """Reads the buckets starting in [start, end]."""
+    paths = sorted(glob.glob(self._file('*')))
+    if start is not None or end is not None:
+      first = month_of(start) if start is not None else ''
+      last = month_of(end) if end is not None else '9999-99'
+      paths = [p for p in paths if first <= os.path.basename(p)[len('month='):-len('.parquet')] <= last]
+    if not paths: return pd.DataFrame(columns=KEY_COLUMNS + VALUE_COLUMNS)
+    df = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+    return filter_range(df, 'bucket_ts', start, end).reset_index(drop=True)
+
+
+def open_rollup(root, grain):
+  """Returns the 'hourly' or 'daily' rollup table under root."""
+  return RollupTable(os.path.join(root, grain), GRAINS[grain])
+
+
+def month_start(month):
+  """Returns the epoch seconds at which a 'YYYY-MM' month starts."""
+  return int(pd.Timestamp(month + '-01').timestamp())
+
+
+def next_month(month):
+  return (pd.Period(month, 'M') + 1).strftime('%Y-%m')
+
+
+def write_sessions(root, sessions):
+  """Replaces the months of every rollup table that the sessions overlap with their aggregates."""
+  for grain, seconds in GRAINS.items():
+    open_rollup(root, grain).replace(aggregate(sessions, seconds))
+
+
+def refresh_months(root, session_store, new_sessions):
+  """
+  Rebuilds the months of the rollup tables that new sessions overlap, from all the stored
+  sessions overlapping them. A month is always rewritten as a whole, so refreshing it
+  again, e.g. after a crash, gives the same table instead of counting sessions twice.
+  """
+  if new_sessions.empty: return
+  start = new_sessions['start_ts']
+  end = np.maximum(new_sessions['end_ts'], start)
+  first, last = month_of(start.min()), month_of(max(end.max() - 1, start.max()))
+  range_start, range_end = month_start(first), month_start(next_month(last))
+
+  # sessions start before the months they overlap, so only later months can be pruned
+  sessions = session_store.read(columns=ROLLUP_COLUMNS, end=range_end - 1)
+  ends = np.maximum(sessions['end_ts'], sessions['start_ts'])
+  sessions = sessions[ends > range_start]
+  for grain, seconds in GRAINS.items():
+    df = aggregate(sessions, seconds)
+    df = df[(df['bucket_ts'] >= range_start) & (df['bucket_ts'] < range_end)]
+    open_rollup(root, grain).replace(df)
+
+
+def rebuild_rollups(root, session_store, logger):
+  """Rebuilds every rollup table from all stored sessions."""
+  for grain in GRAINS:
+    shutil.rmtree(os.path.join(root, grain), ignore_errors=True)
+  os.makedirs(root, exist_ok=True)
+  sessions = session_store.read(columns=ROLLUP_COLUMNS)
+  write_sessions(root, sessions)
+  write_watermark(os.path.join(root, 'watermark.json'), sessions, len(sessions))
+  logger.info(f'Rollups rebuilt from {len(sessions)} session(s).')
+
+
+def update_rollups(root, session_store, new_sessions, offset, logger):
+  """
+  Refreshes the rollup tables with the sessions merged in this cycle.
+
+  Parameters:
+  root (str): The directory of the rollup tables.
+  session_store (storage.CsvStore, storage.ParquetStore or dataset_cache.DatasetCache): The session data.
+  new_sessions (pandas.DataFrame): The rows just appended to the session store.
+  offset (int): The number of rows that preceded new_sessions in the session store.
+
+  The months the new sessions overlap are rebuilt from the store, so a cycle interrupted
+  between the hourly table, the daily table and the watermark is repeated without counting
+  a session twice. Like the anomaly scan, a watermark records how many stored sessions were
+  added. A gap is filled from the store; a missing or inconsistent watermark, or a change of
+  the anomaly rules, rebuilds the tables from all sessions.
+  """
+  watermark_path = os.path.join(root, 'watermark.json')
+  watermark = read_watermark(watermark_path)
+
+  if watermark is None:
+    rebuild = offset > 0 # the first batch of an empty store is simply added
+  else:
+    rebuild = watermark['rules'] != rules_signature() or watermark['rows'] > offset
+
+  if not rebuild and watermark is not None and watermark['rows'] < offset:
+    sessions = session_store.read(columns=ROLLUP_COLUMNS)
+    rows = watermark['rows']
+    if rows and str(sessions.iloc[rows - 1]['session_id']) != watermark['session_id']:
+      rebuild = True
+    else:
+      logger.info(f'Resuming rollups from row {rows}.')
+      new_sessions, offset = sessions.iloc[rows:], rows
+
+  if rebuild:
+    rebuild_rollups(root, session_store, logger)
+    return
+
+  refresh_months(root, session_store, new_sessions)
+  if not new_sessions.empty:
+    write_watermark(watermark_path, new_sessions, offset + len(new_sessions))
+  logger.info(f'Rollups updated with {len(new_sessions)} new session(s).')
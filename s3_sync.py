@@ -0,0 +1,181 @@
+# s3_sync.py
+
+import os, glob, json, math, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from ChargePointDatasetUtils import atomic_write
+
+MB = 1024 ** 2
+MIN_PART_SIZE = 5 * MB # S3 minimum for every part but the last
+MAX_COPY_SIZE = 5 * 1024 ** 3 # S3 maximum for a copied part
+BLOCK_SIZE = 8 * MB
+
+
+class SyncManifest:
+  """
+  The size, modification time, content hash and ETag of every file uploaded so far,
+  kept in a JSON file.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.entries = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        self.entries = json.load(f)
+
+  def get(self, key):
+    with self.lock:
+      return self.entries.get(key)
+
+  def set(self, key, entry):
+    with self.lock:
+      self.entries[key] = entry
+
+  def save(self):
+    with self.lock:
+      os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+      with atomic_write(self.path) as tmp, open(tmp, 'w') as f:
+        json.dump(self.entries, f)
+
+
+def hash_file(path, size, prefix_size=None):
+  """
+  Returns the blake2b digest of the first `size` bytes of a file and, if prefix_size is
+  given, the digest of its first prefix_size bytes, computed in the same pass.
+  """
+  digest, prefix_digest, position = hashlib.blake2b(), None, 0
+  with open(path, 'rb') as f:
+    while position < size:
+      if position == prefix_size: prefix_digest = digest.hexdigest()
+      limit = prefix_size if prefix_size is not None and position < prefix_size else size
+      block = f.read(min(BLOCK_SIZE, limit - position))
+      if not block: break
+      digest.update(block)
+      position += len(block)
+  if position == prefix_size: prefix_digest = digest.hexdigest()
+  return digest.hexdigest(), prefix_digest
+
+
+class S3Sync:
+  """
+  Uploads the files matching a set of glob patterns to an S3 prefix, skipping the files
+  that did not change since their last upload.
+
+  The patterns are expanded again on every sync, so new files are picked up. A file is
+  hashed only when its size or modification time changed, and uploaded only when its
+  content changed. A file that only grew, like the exported CSV files and the logs, is
+  completed on the server: the previous object is copied into a multipart upload and only
+  the appended bytes are sent. Other files are uploaded whole, with multipart chunks sent
+  concurrently.
+
+  Parameters:
+  client (boto3 S3 client): The client to upload with.
+  bucket (str): The destination bucket.
+  prefix (str): The prefix of the object keys, e.g. 'open/27422/11280/'.
+  manifest_path (str): The JSON file recording the uploaded files.
+  root (str): The directory the patterns are relative to. The key of a file is its path
+              relative to the first directory of its pattern, e.g. data/Sessions.csv is
+              uploaded as prefix + 'Sessions.csv'.
+  max_workers (int): Number of files uploaded concurrently.
+  multipart_threshold (int): Files from this size on are uploaded in parts.
+  multipart_chunksize (int): Size of each part, at least 5 MB.
+  """
+
+  def __init__(self, client, bucket, prefix, manifest_path, root='.', max_workers=4,
+               multipart_threshold=16 * MB, multipart_chunksize=16 * MB):
+    self.client = client
+    self.bucket = bucket
+    self.prefix = prefix
+    self.root = root
+    self.max_workers = max_workers
+    self.chunksize = max(multipart_chunksize, MIN_PART_SIZE)
+    self.manifest = SyncManifest(manifest_path)
+    self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                          multipart_chunksize=self.chunksize, max_concurrency=4)
+
+  def scan(self, patterns):
+    """Returns the (path, key) of every file matching the patterns; hidden files are skipped."""
+    files = {}
+    for pattern in patterns:
+      base = os.path.join(self.root, pattern.split('/')[0])
+      for path in glob.glob(os.path.join(self.root, pattern), recursive=True):
+        if os.path.isfile(path) and not path.endswith('.tmp'):
+          files[path] = self.prefix + os.path.relpath(path, base).replace(os.sep, '/')
+    return sorted(files.items())
+
+  def sync(self, patterns, logger=None):
+    """Uploads the changed files; returns the number of files and bytes sent."""
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      results = list(executor.map(lambda item: self._sync_file(*item, logger), self.scan(patterns)))
+    self.manifest.save()
+    sent = [r for r in results if r is not None]
+    return len(sent), sum(sent)
+
+  def _sync_file(self, path, key, logger=None):
+    stat = os.stat(path)
+    size, mtime = stat.st_size, stat.st_mtime_ns
+    entry = self.manifest.get(key)
+    if entry and entry['size'] == size and entry['mtime'] == mtime:
+      return None
+
+    old_size = entry['size'] if entry and entry['size'] <= size else None
+    digest, prefix_digest = hash_file(path, size, old_size)
+    new_entry = {'size': size, 'mtime': mtime, 'hash': digest}
+    file_name = os.path.basename(path)
+
+    if entry and digest == entry['hash']: # rewritten with the same content
+      self.manifest.set(key, dict(entry, mtime=mtime))
+      return None
+
+    if entry and prefix_digest == entry['hash'] and old_size >= MIN_PART_SIZE and self._remote_matches(key, entry):
+      new_entry['etag'] = self._upload_delta(path, key, old_size, size)
+      sent = size - old_size
+      if logger: logger.info(f"Appended {sent} byte(s) to {file_name}.")
+    else:
+      self.client.upload_file(path, self.bucket, key, Config=self.transfer_config)
+      new_entry['etag'] = self.client.head_object(Bucket=self.bucket, Key=key)['ETag']
+      sent = size
+      if logger: logger.info(f"File uploaded: {file_name}")
+    self.manifest.set(key, new_entry)
+    return sent
+
+  def _remote_matches(self, key, entry):
+    """Checks that the object is still the one recorded in the manifest."""
+    try:
+      return self.client.head_object(Bucket=self.bucket, Key=key)['ETag'] == entry.get('etag')
+    except Exception:
+      return False
+
+  def _upload_delta(self, path, key, old_size, size):
+    """Rewrites the object as a copy of its first old_size bytes followed by the new bytes."""
+    upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+    try:
+      parts = []
+      # the existing bytes are copied on the server, in equal parts of at most 5 GB
+      copies = math.ceil(old_size / MAX_COPY_SIZE)
+      copy_size = math.ceil(old_size / copies)
+      for start in range(0, old_size, copy_size):
+        end = min(start + copy_size, old_size) - 1
+        response = self.client.upload_part_copy(
+          Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1,
+          CopySource={'Bucket': self.bucket, 'Key': key}, CopySourceRange=f'bytes={start}-{end}')
+        parts.append({'PartNumber': len(parts) + 1, 'ETag': response['CopyPartResult']['ETag']})
+
+      with open(path, 'rb') as f:
+        f.seek(old_size)
+        position = old_size
+        while position < size:
+          body = f.read(min(self.chunksize, size - position))
+          response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                             PartNumber=len(parts) + 1, Body=body)
+          parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+          position += len(body)
+
+      response = self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                       MultipartUpload={'Parts': parts})
+      return response['ETag']
+    except Exception:
+      self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+      raise
@@ -0,0 +1,127 @@
+# scheduler.py
+
+import os, json, time, random, threading
+from ChargePointDatasetUtils import atomic_write
+
+
+class Job:
+  """
+  A function run every `interval` seconds.
+
+  Parameters:
+  name (str): The name of the job, used for dependencies, triggers and the saved state.
+  func (callable): The function running one cycle of the job.
+  interval (float): The number of seconds between the starts of two runs.
+  depends_on (list): Names of jobs that must have completed a run since this job last
+    started, and must not be running, before this job starts. They do not start while
+    this job is running.
+  jitter (float): Up to this many seconds are added at random to every start time.
+  """
+
+  def __init__(self, name, func, interval, depends_on=(), jitter=0):
+    self.name = name
+    self.func = func
+    self.interval = interval
+    self.depends_on = list(depends_on)
+    self.jitter = jitter
+    self.last_run = None # start time of the last completed run
+    self.next_run = None
+    self.running = False
+
+  def schedule(self, now, after=None):
+    """Sets the next start one interval after `after`; a missed start is caught up at once."""
+    if after is None:
+      self.next_run = now + random.uniform(0, self.jitter)
+    else:
+      self.next_run = max(now, after + self.interval + random.uniform(0, self.jitter))
+
+
+class Scheduler:
+  """
+  Runs jobs at their intervals, each in its own thread, never overlapping a job with itself
+  or with the jobs it depends on. The last run of every job is saved to state_path, so a
+  restarted scheduler catches up on missed runs instead of starting every job at once.
+  """
+
+  def __init__(self, state_path, logger=None, tick=1.0):
+    self.state_path = state_path
+    self.logger = logger
+    self.tick = tick
+    self.jobs = {}
+    self.lock = threading.Condition()
+    self.stopped = False
+
+  def add(self, job):
+    self.jobs[job.name] = job
+
+  def run_now(self, name=None):
+    """Triggers a job, or every job if no name is given, as soon as its dependencies allow."""
+    with self.lock:
+      now = time.time()
+      for job in ([self.jobs[name]] if name else self.jobs.values()):
+        job.next_run = now
+        for dependency in map(self.jobs.get, job.depends_on):
+          if not self._ran_since(dependency, job): # the job would otherwise wait for its next run
+            dependency.next_run = now if dependency.next_run is None else min(dependency.next_run, now)
+      self.lock.notify()
+
+  def stop(self):
+    with self.lock:
+      self.stopped = True
+      self.lock.notify()
+
+  def _load_state(self):
+    state = {}
+    if os.path.exists(self.state_path):
+      with open(self.state_path) as f:
+        state = json.load(f)
+    now = time.time()
+    for job in self.jobs.values():
+      job.last_run = state.get(job.name)
+      job.schedule(now, job.last_run)
+
+  def _save_state(self):
+    os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+    with atomic_write(self.state_path) as tmp, open(tmp, 'w') as f:
+      json.dump({job.name: job.last_run for job in self.jobs.values()}, f)
+
+  def _ran_since(self, dependency, job):
+    """Tells whether the dependency completed a run started at or after the last start of job."""
+    if dependency.last_run is None: return False
+    return job.last_run is None or dependency.last_run >= job.last_run
+
+  def _ready(self, job, now):
+    if job.running or job.next_run > now: return False
+    # a dependency waits for the jobs depending on it, e.g. sessions are not written while alarms read them
+    if any(other.running and job.name in other.depends_on for other in self.jobs.values()): return False
+    for name in job.depends_on:
+      dependency = self.jobs[name]
+      # let the dependency go first, e.g. alarms are joined to the sessions of the run before them
+      if dependency.running or dependency.next_run <= now or not self._ran_since(dependency, job):
+        return False
+    return True
+
+  def _run(self, job, started):
+    try:
+      job.func()
+    except Exception as e:
+      if self.logger: self.logger.error(f"Job {job.name} failed: {str(e)}")
+    with self.lock:
+      job.running = False
+      job.last_run = started
+      job.schedule(time.time(), started)
+      self._save_state()
+      self.lock.notify()
+
+  def run_forever(self):
+    with self.lock:
+      self._load_state()
+      while not self.stopped:
+        now = time.time()
+        for job in self.jobs.values():
+          if self._ready(job, now):
+            job.running = True
+            if self.logger: self.logger.info(f"Starting job {job.name}.")
+            threading.Thread(target=self._run, args=(job, now), name=job.name, daemon=True).start()
+        next_run = min((job.next_run for job in self.jobs.values() if not job.running), default=now + self.tick)
+        self.lock.wait(timeout=min(max(next_run - now, 0), self.tick))
@@ -0,0 +1,182 @@
+# schema.py
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# durations are kept as integer seconds and written to CSV as hh:mm:ss, like the API reports them
+DURATION = 'duration'
+DURATION_DTYPE = 'Int32'
+# local date times are kept as datetime64 seconds and written to CSV as yyyy-mm-dd hh:mm:ss
+LOCAL_TIME = 'local_time'
+LOCAL_TIME_DTYPE = 'datetime64[s]'
+LOCAL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# table -> column -> type; hashed ids and other repeated strings are categorical, so a
+# column holds one small code per row and each distinct string once. Columns that are not
+# listed keep the type they have.
+SCHEMAS = {
+  'sessions': {
+    'session_id': 'int64',
+    'user_id': 'category',
+    'credential_id': 'category',
+    'station_id': 'category',
+    'port_no': 'Int8',
+    'start_ts': 'int64',
+    'end_ts': 'int64',
+    'start_dt': LOCAL_TIME,
+    'end_dt': LOCAL_TIME,
+    'energy': 'float64', # written to CSV in the shortest form, e.g. 6.6678 for the API's 6.667800
+    'total_charging_duration': DURATION,
+    'total_session_duration': DURATION,
+    'address': 'category',
+  },
+  'alarms': {
+    'station_id': 'category',
+    'station_name': 'category',
+    'model': 'category',
+    'org_id': 'category',
+    'port_no': 'Int8',
+    'alarm_type': 'category',
+    'alarm_ts': 'int64',
+    'alarm_dt': LOCAL_TIME,
+    'session_id': 'Int64', # alarms without a session have none
+  },
+  'stations': {
+    'station_id': 'category',
+    'org_id': 'category',
+    'station_group': 'category',
+    'model': 'category',
+    'activation_dt': LOCAL_TIME,
+    'timezone_offset': 'category',
+    'manufacturer': 'category',
+    'port_no': 'Int8',
+    'status': 'category',
+    'level': 'category',
+    'connector': 'category',
+    'location_lat': 'float64', # likewise
+    'location_long': 'float64', # likewise, e.g. -122.85584 for -122.855840
+  },
+}
+
+
+def parse_duration(text):
+  """Parses hh:mm:ss, e.g. 27:05:09, or any other format of pd.to_timedelta, to seconds."""
+  try:
+    hours, minutes, seconds = text.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+  except (AttributeError, ValueError):
+    delta = pd.to_timedelta(text, errors='coerce')
+    return np.nan if pd.isna(delta) else delta // pd.Timedelta(seconds=1)
+
+
+def duration_seconds(values):
+  """Converts a column of hh:mm:ss strings, or of seconds, to integer seconds, parsing each distinct string once."""
+  if pd.api.types.is_numeric_dtype(values):
+    return values.astype(DURATION_DTYPE)
+  codes, uniques = pd.factorize(values)
+  seconds = np.array([parse_duration(text) for text in uniques] + [np.nan], dtype=np.float64) # code -1 marks missing values
+  return pd.Series(seconds[codes], index=values.index, name=values.name).astype(DURATION_DTYPE)
+
+
+def format_duration(values):
+  """Formats a column of seconds as hh:mm:ss; hours are not wrapped at a day, e.g. 27:05:09."""
+  seconds = values.astype('Int64')
+  codes, uniques = pd.factorize(seconds)
+  text = np.array([f'{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}' for s in uniques] + [None], dtype=object)
+  return pd.Series(text[codes], index=values.index, name=values.name)
+
+
+def local_time(values):
+  """Parses a column of yyyy-mm-dd hh:mm:ss strings to datetime64 seconds."""
+  if pd.api.types.is_datetime64_dtype(values):
+    return values.astype(LOCAL_TIME_DTYPE)
+  return pd.to_datetime(values, format=LOCAL_TIME_FORMAT, errors='coerce').astype(LOCAL_TIME_DTYPE)
+
+
+def format_local_time(values):
+  """Formats a column of datetime64 values as yyyy-mm-dd hh:mm:ss."""
+  # numpy formats this layout in C, strftime formats one value at a time
+  text = np.datetime_as_string(values.to_numpy(dtype=LOCAL_TIME_DTYPE), unit='s').astype(object)
+  text[values.isna().to_numpy()] = None
+  return pd.Series(text, index=values.index, name=values.name).str.replace('T', ' ', regex=False)
+
+
+def as_category(values):
+  """Returns a categorical column with string categories, so the categories of any two frames can be merged."""
+  if not isinstance(values.dtype, pd.CategoricalDtype):
+    values = values.astype('category')
+  categories = values.cat.categories
+  if categories.dtype == 'str': return values
+  if categories.dtype.kind == 'f' and (categories == categories.round()).all():
+    categories = categories.astype('int64') # integer ids read along with missing values
+  return values.cat.rename_categories(categories.astype('str')) # e.g. numeric ids, only the categories are converted
+
+
+def has_type(values, dtype):
+  if dtype == 'category':
+    return isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.dtype == 'str'
+  return str(values.dtype) == {DURATION: DURATION_DTYPE, LOCAL_TIME: LOCAL_TIME_DTYPE}.get(dtype, dtype)
+
+
+def cast(values, dtype):
+  if dtype == DURATION:
+    return duration_seconds(values)
+  if dtype == LOCAL_TIME:
+    return local_time(values)
+  if dtype == 'category':
+    return as_category(values)
+  # empty strings, e.g. alarms without a session, become missing values
+  return pd.to_numeric(values, errors='coerce').astype(dtype)
+
+
+def enforce(df, table):
+  """Casts the columns of a frame of a table to the types of its schema."""
+  schema = SCHEMAS.get(table, {})
+  changed = {}
+  for column, dtype in schema.items():
+    if column in df.columns and not has_type(df[column], dtype):
+      changed[column] = cast(df[column], dtype)
+  if not changed: return df
+  df = df.copy(deep=False)
+  for column, values in changed.items():
+    df[column] = values
+  return df
+
+
+def concat(frames, table):
+  """
+  Concatenates frames of a table. Categorical columns are merged by their codes, as
+  pd.concat turns categoricals with different categories into strings.
+  """
+  frames = [df for df in frames if len(df.columns)]
+  if not frames: return pd.DataFrame()
+  df = pd.concat(frames, ignore_index=True)
+  for column, dtype in SCHEMAS.get(table, {}).items():
+    if dtype != 'category' or column not in df.columns or has_type(df[column], dtype): continue
+    parts = [frame[column] for frame in frames if column in frame.columns]
+    if len(parts) == len(frames) and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+      df[column] = union_categoricals([as_category(part) for part in parts], ignore_order=True)
+  return enforce(df, table)
+
+
+def to_csv_frame(df, table):
+  """Returns the frame as written to CSV, with the durations and local date times formatted as text."""
+  formatters = {DURATION: (pd.api.types.is_numeric_dtype, format_duration),
+                LOCAL_TIME: (pd.api.types.is_datetime64_dtype, format_local_time)}
+  columns = {column: formatters[dtype] for column, dtype in SCHEMAS.get(table, {}).items()
+             if dtype in formatters and column in df.columns}
+  if not columns: return df
+  df = df.copy(deep=False)
+  for column, (is_typed, formatter) in columns.items():
+    if is_typed(df[column]):
+      df[column] = formatter(df[column])
+  return df
+
+
+def read_csv(path, table, **kwargs):
+  """Reads a CSV file of a table with the types of its schema."""
+  schema = SCHEMAS.get(table, {})
+  # ids must stay strings even if every value of a file looks like a number
+  dtype = {column: 'category' for column, t in schema.items() if t == 'category'}
+  return enforce(pd.read_csv(path, dtype=dtype, **kwargs), table)
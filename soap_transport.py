@@ -0,0 +1,101 @@
+# soap_transport.py
+
+import os, time, random, threading
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from zeep.cache import SqliteCache
+from zeep.exceptions import Fault, TransportError
+from zeep.transports import Transport
+
+DEFAULT_WSDL_URL = "https://webservices.chargepoint.com/cp_api_5.1.wsdl"
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def build_transport(cache_path, pool_size=16, timeout=30, operation_timeout=120, cache_ttl=30 * 86400):
+  """
+  Returns a zeep transport shared by all worker threads.
+
+  Parameters:
+  cache_path (str): SQLite file caching the WSDL and XSD documents, so a restart does not
+                    download them again and works while the WSDL host is unreachable.
+  pool_size (int): Number of pooled HTTP connections, at least one per concurrent request.
+  timeout (int): Timeout in seconds for loading the WSDL and XSD documents.
+  operation_timeout (int): Timeout in seconds for each API call.
+  cache_ttl (int): Number of seconds the cached documents are used before being refreshed.
+  """
+  os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  return Transport(session=session, cache=SqliteCache(path=cache_path, timeout=cache_ttl),
+                   timeout=timeout, operation_timeout=operation_timeout)
+
+
+class RateLimiter:
+  """Spaces out the calls of all threads to at most `rate` calls per second."""
+
+  def __init__(self, rate=None):
+    self.interval = 1.0 / rate if rate else 0.0
+    self.lock = threading.Lock()
+    self.next_call = time.monotonic()
+
+  def wait(self):
+    with self.lock:
+      now = time.monotonic()
+      delay = self.next_call - now
+      self.next_call = max(now, self.next_call) + self.interval
+    if delay > 0:
+      time.sleep(delay)
+
+  def pause(self, seconds):
+    """Holds back every thread, e.g. after the service reported a rate limit."""
+    with self.lock:
+      self.next_call = max(self.next_call, time.monotonic() + seconds)
+
+
+class RetryPolicy:
+  """
+  Calls an API operation, retrying transient failures with exponential backoff and jitter.
+
+  Connection errors, timeouts and HTTP 429/5xx responses are retried. A rate-limit response
+  also pauses the other threads through the shared RateLimiter for at least
+  rate_limit_delay seconds.
+  """
+
+  def __init__(self, retries=5, base_delay=1.0, max_delay=60.0, rate_limit_delay=60.0, limiter=None):
+    self.retries = retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.rate_limit_delay = rate_limit_delay
+    self.limiter = limiter or RateLimiter()
+
+  def call(self, operation, *args):
+    for attempt in range(self.retries + 1):
+      self.limiter.wait()
+      try:
+        return operation(*args)
+      except Exception as e:
+        if attempt == self.retries or not is_retryable(e): raise
+        metrics.inc('api_retries_total')
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if is_rate_limited(e):
+          delay = max(delay, self.rate_limit_delay)
+          self.limiter.pause(delay)
+        time.sleep(delay)
+
+
+def is_rate_limited(e):
+  if isinstance(e, TransportError):
+    return e.status_code == 429
+  return isinstance(e, Fault) and 'limit' in str(e.message).lower()
+
+
+def is_retryable(e):
+  if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+    return True
+  if isinstance(e, TransportError):
+    return e.status_code in RETRY_STATUS_CODES
+  return is_rate_limited(e)
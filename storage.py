@@ -0,0 +1,242 @@
+# storage.py
+
+import os, glob, time, shutil, threading, configparser
+from collections import defaultdict
+import pandas as pd
+import schema
+from ChargePointDatasetUtils import atomic_write
+
+cwd = os.getcwd()
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# dataset name -> (csv path option in [Paths], partition column); the column types are in schema.SCHEMAS
+DATASETS = {
+  'sessions': ('session_data_path', 'start_ts'),
+  'alarms': ('alarm_data_path', 'alarm_ts'),
+  'stations': ('station_data_path', None),
+}
+
+# one lock per dataset location, shared by every worker thread of the process
+_locks = defaultdict(threading.RLock)
+
+
+class CsvStore:
+  """
+  A dataset kept in a single CSV file; new rows are appended to the end of the file.
+
+  Durations are written as hh:mm:ss text and parsed back to seconds on read.
+  """
+
+  def __init__(self, path, partition_column=None, table=None):
+    self.path = path
+    self.partition_column = partition_column
+    self.table = table # the schema of the rows, see schema.SCHEMAS
+    self.lock = _locks[path]
+
+  def exists(self):
+    return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+  def read(self, columns=None, start=None, end=None):
+    """Reads the given columns of the rows whose partition column lies in [start, end]."""
+    with self.lock:
+      if not self.exists(): return schema.enforce(pd.DataFrame(columns=columns), self.table)
+      usecols = columns
+      if columns is not None and (start is not None or end is not None):
+        usecols = list(dict.fromkeys(columns + [self.partition_column]))
+      df = schema.read_csv(self.path, self.table, usecols=usecols)
+    df = filter_range(df, self.partition_column, start, end)
+    return df if columns is None else df[columns]
+
+  def count(self):
+    with self.lock:
+      if not self.exists(): return 0
+      return len(pd.read_csv(self.path, usecols=[0]))
+
+  def version(self):
+    """Changes whenever the file is written."""
+    if not os.path.exists(self.path): return None
+    stat = os.stat(self.path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+  def max(self, column):
+    values = self.read(columns=[column])[column]
+    return None if values.empty else values.max()
+
+  def append(self, df):
+    if df.empty: return
+    df = schema.to_csv_frame(schema.enforce(df, self.table), self.table)
+    with self.lock:
+      if self.exists():
+        header = pd.read_csv(self.path, nrows=0).columns
+        df.reindex(columns=header).to_csv(self.path, mode='a', header=False, index=False)
+      else:
+        df.to_csv(self.path, index=False)
+
+  def overwrite(self, df):
+    df = schema.to_csv_frame(schema.enforce(df, self.table), self.table)
+    with self.lock:
+      df.to_csv(self.path, index=False)
+
+  def compact(self):
+    pass # a single file is already compact
+
+  def compact_if_due(self, frequency):
+    pass
+
+  def export_csv(self, path):
+    with self.lock:
+      if os.path.abspath(path) != os.path.abspath(self.path):
+        shutil.copyfile(self.path, path)
+
+
+class ParquetStore:
+  """
+  A dataset kept as parquet files partitioned by the month of its partition column.
+
+  Every append writes new part files, so an update costs O(new rows) instead of rewriting
+  the whole history. Part files are named after their creation time, and reading without a
+  range returns the rows in the order they were appended. compact() merges the parts of each
+  partition into one file. The columns keep the types of the schema, e.g. categorical ids.
+  """
+
+  def __init__(self, path, partition_column=None, table=None):
+    self.path = path
+    self.partition_column = partition_column
+    self.table = table # the schema of the rows, see schema.SCHEMAS
+    self.lock = _locks[path]
+
+  def _partition(self, month):
+    return os.path.join(self.path, f'month={month}') if month else self.path
+
+  def _parts(self, start=None, end=None):
+    pattern = os.path.join(self.path, 'month=*', 'part-*.parquet') if self.partition_column else os.path.join(self.path, 'part-*.parquet')
+    parts = glob.glob(pattern)
+    if self.partition_column and (start is not None or end is not None):
+      # prune the partitions outside of the requested months
+      first = month_of(start) if start is not None else ''
+      last = month_of(end) if end is not None else '9999-99'
+      parts = [p for p in parts if first <= os.path.basename(os.path.dirname(p))[len('month='):] <= last]
+    return sorted(parts, key=os.path.basename)
+
+  def exists(self):
+    return len(self._parts()) > 0
+
+  def read(self, columns=None, start=None, end=None):
+    """Reads the given columns of the rows whose partition column lies in [start, end]."""
+    usecols = columns
+    if columns is not None and (start is not None or end is not None):
+      usecols = list(dict.fromkeys(columns + [self.partition_column]))
+    with self.lock:
+      frames = [pd.read_parquet(part, columns=usecols) for part in self._parts(start, end)]
+    if not frames: return schema.enforce(pd.DataFrame(columns=columns), self.table)
+    df = filter_range(schema.concat(frames, self.table), self.partition_column, start, end)
+    return df if columns is None else df[columns]
+
+  def count(self):
+    import pyarrow.parquet as pq
+    with self.lock:
+      return sum(pq.ParquetFile(part).metadata.num_rows for part in self._parts())
+
+  def version(self):
+    """Changes whenever parts are written, replaced or removed."""
+    with self.lock:
+      return tuple((part, os.stat(part).st_mtime_ns) for part in self._parts())
+
+  def max(self, column):
+    values = self.read(columns=[column])[column]
+    return None if values.empty else values.max()
+
+  def _write(self, df, month, name=None):
+    partition = self._partition(month)
+    os.makedirs(partition, exist_ok=True)
+    name = name or f'part-{time.time_ns():020d}.parquet'
+    with atomic_write(os.path.join(partition, name)) as tmp:
+      df.to_parquet(tmp, index=False)
+    return name
+
+  def append(self, df):
+    if df.empty: return
+    df = schema.enforce(df, self.table)
+    with self.lock:
+      if not self.partition_column:
+        self._write(df, None)
+        return
+      months = month_of(df[self.partition_column])
+      for month in pd.unique(months):
+        self._write(df[months == month], month)
+
+  def overwrite(self, df):
+    with self.lock:
+      old_parts = self._parts()
+      self.append(df)
+      for part in old_parts:
+        os.remove(part)
+
+  def compact(self):
+    """Merges the part files of each partition into a single file, keeping the oldest name."""
+    with self.lock:
+      by_partition = defaultdict(list)
+      for part in self._parts():
+        by_partition[os.path.dirname(part)].append(part)
+      for partition, parts in by_partition.items():
+        if len(parts) < 2: continue
+        df = schema.concat([pd.read_parquet(part) for part in parts], self.table)
+        month = os.path.basename(partition)[len('month='):] if self.partition_column else None
+        self._write(df, month, os.path.basename(parts[0])) # replaces the oldest part
+        for part in parts[1:]:
+          os.remove(part)
+      open(os.path.join(self.path, '_compacted'), 'w').close()
+
+  def compact_if_due(self, frequency):
+    marker = os.path.join(self.path, '_compacted')
+    if not self.exists(): return
+    if not os.path.exists(marker) or time.time() - os.path.getmtime(marker) >= frequency:
+      self.compact()
+
+  def export_csv(self, path):
+    schema.to_csv_frame(self.read(), self.table).to_csv(path, index=False)
+
+
+def month_of(ts):
+  """Formats epoch seconds (a scalar or a Series) as the 'YYYY-MM' partition name."""
+  if isinstance(ts, pd.Series):
+    return pd.to_datetime(ts, unit='s').dt.strftime('%Y-%m').to_numpy()
+  return pd.Timestamp(int(ts), unit='s').strftime('%Y-%m')
+
+
+def filter_range(df, column, start, end):
+  if column is None or df.empty: return df
+  if start is not None: df = df[df[column] >= start]
+  if end is not None: df = df[df[column] <= end]
+  return df
+
+
+def open_store(name):
+  """Returns the store of a dataset ('sessions', 'alarms' or 'stations') configured in config.ini."""
+  option, partition_column = DATASETS[name]
+  if config.get('Storage', 'backend') == 'parquet':
+    return ParquetStore(os.path.join(cwd, config.get('Storage', 'root'), name), partition_column, name)
+  return CsvStore(os.path.join(cwd, config.get('Paths', option)), partition_column, name)
+
+
+def import_csv(store, name):
+  """Loads the CSV file of a dataset into an empty store, e.g. after switching backends."""
+  path = os.path.join(cwd, config.get('Paths', DATASETS[name][0]))
+  if not store.exists() and os.path.exists(path) and os.path.getsize(path) > 0:
+    store.append(schema.read_csv(path, name))
+    return True
+  return False
+
+
+def export_all():
+  """Writes every stored dataset to its CSV path in [Paths]."""
+  for name, (option, _) in DATASETS.items():
+    store = open_store(name)
+    if store.exists():
+      store.export_csv(os.path.join(cwd, config.get('Paths', option)))
+
+
+if __name__ == '__main__':
+  # python storage.py exports the datasets to CSV on demand
+  export_all()
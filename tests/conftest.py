@@ -0,0 +1,40 @@
+# conftest.py
+
+import os, sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules live at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import schema
+
+
+def make_sessions(n=500, seed=0):
+  """Typed sessions over three months, as read from the store."""
+  rng = np.random.default_rng(seed)
+  start = np.sort(rng.integers(1_672_531_200, 1_672_531_200 + 90 * 86400, n))
+  session_seconds = rng.integers(60, 30 * 3600, n)
+  df = pd.DataFrame({
+    'session_id': np.arange(n, dtype=np.int64) + 100_000_000,
+    'user_id': [f'{u:010x}' for u in rng.integers(0, 50, n)],
+    'credential_id': [f'CRED{u}' for u in rng.integers(0, 50, n)],
+    'station_id': [f'{s:010x}' for s in rng.integers(0, 10, n)],
+    'port_no': rng.integers(1, 3, n),
+    'start_ts': start,
+    'end_ts': start + session_seconds,
+    'start_dt': pd.to_datetime(start - 8 * 3600, unit='s'),
+    'end_dt': pd.to_datetime(start + session_seconds - 8 * 3600, unit='s'),
+    'energy': rng.gamma(2.0, 4.0, n).round(6),
+    'total_charging_duration': rng.integers(0, 30 * 3600, n),
+    'total_session_duration': session_seconds,
+    'address': [f'{s} University Dr' for s in rng.integers(0, 10, n)],
+  })
+  return schema.enforce(df, 'sessions')
+
+
+@pytest.fixture
+def sessions_frame():
+  """Builds typed sessions, see make_sessions."""
+  return make_sessions
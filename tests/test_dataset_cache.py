@@ -0,0 +1,53 @@
+# test_dataset_cache.py
+#
+# Reads of a cached store that holds no rows yet, then after a first append.
+
+import logging
+import pandas as pd
+import pytest
+import schema
+from anomalies import SCAN_COLUMNS, scan_anomalies
+from dataset_cache import DatasetCache
+from key_index import open_index
+from storage import CsvStore, ParquetStore
+from update_worker import query_session_for_id
+
+STORES = {
+  'parquet': lambda tmp_path: ParquetStore(str(tmp_path / 'sessions'), 'start_ts', 'sessions'),
+  'csv': lambda tmp_path: CsvStore(str(tmp_path / 'Sessions.csv'), 'start_ts', 'sessions'),
+}
+
+
+@pytest.fixture(params=sorted(STORES))
+def cache(request, tmp_path):
+  return DatasetCache(STORES[request.param](tmp_path))
+
+
+def test_empty_store(cache):
+  columns = ['session_id', 'station_id', 'start_ts', 'total_session_duration']
+  for df in (cache.get(columns=columns), cache.read(columns=columns), cache.read(columns=columns, start=0, end=1)):
+    assert df.empty and list(df.columns) == columns
+    assert all(schema.has_type(df[column], schema.SCHEMAS['sessions'][column]) for column in columns)
+  assert cache.count() == 0
+  assert cache.max('start_ts') is None
+
+
+def test_empty_store_readers(cache, tmp_path):
+  index = open_index('sessions', cache, str(tmp_path / 'index')) # rebuilt from the empty store
+  assert len(index) == 0
+  index.rebuild(cache)
+  scan_anomalies(str(tmp_path), cache, 'Anomalies.csv', logging.getLogger(__name__), '.watermark.json')
+  assert pd.read_csv(tmp_path / 'Anomalies.csv').empty
+
+  # alarms get an empty session_id, so their stored columns do not depend on the sessions
+  alarms = pd.DataFrame({'station_id': ['a'], 'port_no': [1], 'alarm_ts': [1_672_531_300]})
+  sessions = cache.read(columns=['session_id', 'station_id', 'port_no', 'start_ts', 'end_ts'])
+  assert query_session_for_id(alarms, sessions)['session_id'].tolist() == ['']
+
+
+def test_first_append(cache, sessions_frame):
+  cache.get() # caches the empty store
+  df = sessions_frame(n=50)
+  cache.append(df)
+  assert cache.count() == 50
+  pd.testing.assert_frame_equal(cache.read(columns=SCAN_COLUMNS), df[SCAN_COLUMNS])
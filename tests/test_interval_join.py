@@ -0,0 +1,92 @@
+# test_interval_join.py
+#
+# Compares the interval index with the original row-by-row query_session_for_id.
+
+import numpy as np
+import pandas as pd
+import pytest
+from interval_join import SessionIntervalIndex
+from update_worker import query_session_for_id
+
+
+def legacy_query_session_for_id(alarms, sessions):
+  # the original implementation, a boolean mask per alarm followed by iloc[0]
+  if alarms.empty or sessions.empty: return alarms
+  alarms['session_id'] = pd.Series('', index=alarms.index, dtype=object) # '' under pandas 3 would be a str column
+  for i, alarm_row in alarms.iterrows():
+    filtered_sessions = sessions[
+      (sessions['station_id'] == alarm_row['station_id']) &
+      (sessions['port_no'] == alarm_row['port_no'])
+    ]
+    matching_sessions = filtered_sessions[
+      (filtered_sessions['start_ts'] < alarm_row['alarm_ts']) &
+      (filtered_sessions['end_ts'] > alarm_row['alarm_ts'])
+    ]
+    if not matching_sessions.empty:
+      alarms.at[i, 'session_id'] = matching_sessions.iloc[0]['session_id']
+  return alarms
+
+
+def random_case(seed, n_sessions=60, n_alarms=80):
+  """Sessions that overlap on few station ports, and alarms on and off their boundaries."""
+  rng = np.random.default_rng(seed)
+  start = rng.integers(0, 5000, n_sessions)
+  sessions = pd.DataFrame({
+    'session_id': np.arange(n_sessions, dtype=np.int64) + 1000,
+    'station_id': rng.choice(['s1', 's2', 's3'], n_sessions),
+    'port_no': pd.array(rng.integers(1, 3, n_sessions), dtype='Int8'),
+    'start_ts': start,
+    'end_ts': start + rng.integers(0, 1500, n_sessions),
+  })
+  sessions.loc[rng.random(n_sessions) < 0.1, 'port_no'] = pd.NA
+
+  # a third of the alarms fall exactly on a session start or end
+  alarm_ts = rng.integers(-100, 6600, n_alarms)
+  on_boundary = rng.random(n_alarms) < 0.33
+  alarm_ts[on_boundary] = rng.choice(np.concatenate([sessions['start_ts'], sessions['end_ts']]), on_boundary.sum())
+  alarms = pd.DataFrame({
+    'station_id': rng.choice(['s1', 's2', 's3', 's4'], n_alarms), # s4 has no sessions
+    'port_no': rng.integers(1, 4, n_alarms).astype(np.float16), # port 3 has no sessions
+    'alarm_type': 'Unreachable',
+    'alarm_ts': alarm_ts,
+  })
+  return alarms, sessions
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_matches_legacy_query(seed):
+  alarms, sessions = random_case(seed)
+  expected = legacy_query_session_for_id(alarms.copy(), sessions)
+  result = query_session_for_id(alarms.copy(), sessions)
+  assert result['session_id'].tolist() == expected['session_id'].tolist()
+
+
+@pytest.mark.parametrize('alarm_ports', [
+  pd.array([1, 2, pd.NA], dtype='Int8'),
+  np.array([1, 2, np.nan], dtype=np.float16),
+])
+def test_port_types(alarm_ports):
+  sessions = pd.DataFrame({'session_id': [1, 2, 3], 'station_id': ['a', 'a', 'a'],
+                           'port_no': pd.array([1, 2, pd.NA], dtype='Int8'),
+                           'start_ts': [0, 0, 0], 'end_ts': [100, 100, 100]})
+  alarms = pd.DataFrame({'station_id': ['a', 'a', 'a'], 'port_no': alarm_ports, 'alarm_ts': [50, 50, 50]})
+  expected = legacy_query_session_for_id(alarms.copy(), sessions)
+  assert query_session_for_id(alarms.copy(), sessions)['session_id'].tolist() == expected['session_id'].tolist() == [1, 2, '']
+
+
+def test_overlapping_sessions_return_the_first_in_frame_order():
+  # the later row starts earlier, the earlier row is still the one returned
+  sessions = pd.DataFrame({'session_id': [10, 11, 12], 'station_id': ['a'] * 3, 'port_no': [1, 1, 1],
+                           'start_ts': [40, 0, 45], 'end_ts': [60, 100, 50]})
+  alarms = pd.DataFrame({'station_id': ['a'] * 4, 'port_no': [1] * 4, 'alarm_ts': [20, 47, 55, 80]})
+  index = SessionIntervalIndex(sessions)
+  assert index.lookup(alarms, 'alarm_ts').tolist() == [1, 0, 0, 1]
+  expected = legacy_query_session_for_id(alarms.copy(), sessions)
+  assert query_session_for_id(alarms.copy(), sessions)['session_id'].tolist() == expected['session_id'].tolist()
+
+
+def test_unmatched_alarms():
+  sessions = pd.DataFrame({'session_id': [1], 'station_id': ['a'], 'port_no': [1], 'start_ts': [10], 'end_ts': [20]})
+  alarms = pd.DataFrame({'station_id': ['a', 'a', 'a', 'b'], 'port_no': [1, 1, 2, 1], 'alarm_ts': [10, 20, 15, 15]})
+  assert (SessionIntervalIndex(sessions).lookup(alarms, 'alarm_ts') == -1).all()
+  assert query_session_for_id(alarms.copy(), sessions)['session_id'].tolist() == [''] * 4
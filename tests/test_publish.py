@@ -0,0 +1,73 @@
+# test_publish.py
+#
+# Round trips of the published files and the skipping of unchanged months.
+
+import os, gzip
+import pandas as pd
+import pytest
+import schema
+from publish import publish_dataset
+
+FORMATS = ['csv.gz', 'parquet']
+
+
+def alarms_frame():
+  return schema.enforce(pd.DataFrame({
+    'station_id': ['a', 'b', 'a'], 'station_name': ['A', 'B', 'A'], 'model': ['CT4020-HD'] * 3, 'org_id': ['o'] * 3,
+    'port_no': [1, 2, 1], 'alarm_type': ['Unreachable', 'GFCI Trip', 'Reachable'],
+    'alarm_ts': [1_672_531_300, 1_675_209_700, 1_677_628_900],
+    'alarm_dt': ['2022-12-31 16:01:40', '2023-01-31 16:01:40', '2023-02-28 16:01:40'],
+    'session_id': ['', '100000001', ''],
+  }), 'alarms')
+
+
+def month_parts(df, column):
+  months = pd.to_datetime(df[column], unit='s').dt.strftime('%Y-%m')
+  return {month: part.reset_index(drop=True) for month, part in df.groupby(months)}
+
+
+@pytest.mark.parametrize('name, column', [('sessions', 'start_ts'), ('alarms', 'alarm_ts')])
+def test_round_trip(tmp_path, sessions_frame, name, column):
+  df = sessions_frame() if name == 'sessions' else alarms_frame()
+  entry, written = publish_dataset(name, df, str(tmp_path), FORMATS, None, column)
+  parts = month_parts(df, column)
+  assert sorted(entry['partitions']) == sorted(parts)
+  assert written == len(parts) * len(FORMATS)
+
+  for month, part in parts.items():
+    files = entry['partitions'][month]['files']
+    assert entry['partitions'][month]['rows'] == len(part)
+
+    # parquet keeps the rows and types exactly; it has no seconds unit, date times come back as milliseconds
+    parquet = pd.read_parquet(tmp_path / name / files['parquet']['path'])
+    assert {str(dtype) for dtype in parquet.select_dtypes('datetime').dtypes} <= {'datetime64[ms]'}
+    pd.testing.assert_frame_equal(schema.enforce(parquet, name), part)
+
+    # csv holds the same values, with the layout of the exported CSV files
+    csv = schema.read_csv(tmp_path / name / files['csv.gz']['path'], name)
+    pd.testing.assert_frame_equal(csv, part, check_categorical=False)
+    with gzip.open(tmp_path / name / files['csv.gz']['path'], 'rt') as f:
+      assert f.read() == schema.to_csv_frame(part, name).to_csv(index=False)
+
+
+def test_unchanged_months_are_not_rewritten(tmp_path, sessions_frame):
+  df = sessions_frame()
+  entry, _ = publish_dataset('sessions', df, str(tmp_path), FORMATS, None, 'start_ts')
+  paths = {month: [tmp_path / 'sessions' / f['path'] for f in e['files'].values()] for month, e in entry['partitions'].items()}
+  mtimes = {path: os.stat(path).st_mtime_ns for month_paths in paths.values() for path in month_paths}
+
+  again, written = publish_dataset('sessions', df, str(tmp_path), FORMATS, entry, 'start_ts')
+  assert written == 0
+  assert again == entry
+  assert all(os.stat(path).st_mtime_ns == mtime for path, mtime in mtimes.items())
+
+  # a change of the last month rewrites its files only
+  last = max(entry['partitions'])
+  changed = df.copy()
+  changed.loc[changed.index[-1], 'energy'] += 1
+  updated, written = publish_dataset('sessions', changed, str(tmp_path), FORMATS, again, 'start_ts')
+  assert written == len(FORMATS)
+  assert updated['partitions'][last]['fingerprint'] != entry['partitions'][last]['fingerprint']
+  for month, month_paths in paths.items():
+    if month != last:
+      assert all(os.stat(path).st_mtime_ns == mtimes[path] for path in month_paths)
@@ -0,0 +1,71 @@
+# test_rollups.py
+#
+# Incremental rollup updates against a rebuild from all sessions, also after an interrupted cycle.
+
+import logging
+import pandas as pd
+import pytest
+import rollups
+from rollups import GRAINS, open_rollup, rebuild_rollups, update_rollups
+from storage import ParquetStore
+
+logger = logging.getLogger(__name__)
+
+
+def batches(sessions_frame, n=4):
+  df = sessions_frame(n=800, seed=1)
+  size = len(df) // n
+  return [df.iloc[i * size:(i + 1) * size].reset_index(drop=True) for i in range(n)]
+
+
+def tables(root):
+  return {grain: open_rollup(root, grain).read() for grain in GRAINS}
+
+
+def run_cycles(root, store, parts):
+  for part in parts:
+    offset = store.count()
+    store.append(part)
+    update_rollups(root, store, part, offset, logger)
+
+
+def expected(tmp_path, parts):
+  store = ParquetStore(str(tmp_path / 'expected' / 'sessions'), 'start_ts', 'sessions')
+  for part in parts:
+    store.append(part)
+  root = str(tmp_path / 'expected' / 'rollups')
+  rebuild_rollups(root, store, logger)
+  return tables(root)
+
+
+def assert_tables_equal(actual, wanted):
+  for grain in GRAINS:
+    pd.testing.assert_frame_equal(actual[grain], wanted[grain])
+
+
+def test_incremental_updates(tmp_path, sessions_frame):
+  parts = batches(sessions_frame)
+  store = ParquetStore(str(tmp_path / 'sessions'), 'start_ts', 'sessions')
+  run_cycles(str(tmp_path / 'rollups'), store, parts)
+  assert_tables_equal(tables(str(tmp_path / 'rollups')), expected(tmp_path, parts))
+
+
+@pytest.mark.parametrize('failing_write', [1, 2]) # after the hourly table, or before the watermark
+def test_interrupted_cycle(tmp_path, monkeypatch, sessions_frame, failing_write):
+  parts = batches(sessions_frame)
+  root = str(tmp_path / 'rollups')
+  store = ParquetStore(str(tmp_path / 'sessions'), 'start_ts', 'sessions')
+  run_cycles(root, store, parts[:2])
+
+  replace, writes = rollups.RollupTable.replace, []
+  def crashing_replace(table, df):
+    replace(table, df)
+    writes.append(table.path)
+    if len(writes) == failing_write: raise RuntimeError('crash')
+  monkeypatch.setattr(rollups.RollupTable, 'replace', crashing_replace)
+  with pytest.raises(RuntimeError):
+    run_cycles(root, store, parts[2:3])
+  monkeypatch.undo()
+
+  run_cycles(root, store, parts[3:])
+  assert_tables_equal(tables(root), expected(tmp_path, parts))
@@ -0,0 +1,109 @@
+# test_s3_sync.py
+#
+# Uploads to a moto S3 stand-in: skipped, appended and fully uploaded files.
+
+import os
+import boto3
+import pytest
+from s3_sync import MB, S3Sync
+
+mock_aws = pytest.importorskip('moto').mock_aws # the S3 stand-in
+
+BUCKET = 'evdataset'
+PREFIX = 'open/27422/11280/'
+
+
+@pytest.fixture
+def client(monkeypatch):
+  for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+    monkeypatch.setenv(name, 'testing')
+  with mock_aws():
+    client = boto3.client('s3', region_name='us-east-1')
+    client.create_bucket(Bucket=BUCKET)
+    yield client
+
+
+@pytest.fixture
+def sync(client, tmp_path):
+  os.makedirs(tmp_path / 'data')
+  return S3Sync(client, BUCKET, PREFIX, str(tmp_path / 'manifest.json'), root=str(tmp_path),
+                multipart_threshold=8 * MB, multipart_chunksize=5 * MB)
+
+
+def write(path, data, mode='wb'):
+  with open(path, mode) as f:
+    f.write(data)
+
+
+def remote(client, key):
+  return client.get_object(Bucket=BUCKET, Key=PREFIX + key)['Body'].read()
+
+
+def test_unchanged_files_are_skipped(client, sync, tmp_path):
+  write(tmp_path / 'data' / 'Sessions.csv', b'session_id\n1\n')
+  write(tmp_path / 'data' / 'Alarms.csv', b'alarm_ts\n2\n')
+  assert sync.sync(['data/*.csv']) == (2, 24)
+  assert sync.sync(['data/*.csv']) == (0, 0)
+
+  # rewritten with the same content, only the manifest is updated
+  os.utime(tmp_path / 'data' / 'Sessions.csv', ns=(0, 0))
+  assert sync.sync(['data/*.csv']) == (0, 0)
+  assert sync.manifest.get(PREFIX + 'Sessions.csv')['mtime'] == 0
+  assert remote(client, 'Sessions.csv') == b'session_id\n1\n'
+
+
+def test_appended_bytes_are_sent(client, sync, tmp_path):
+  path = tmp_path / 'data' / 'Sessions.csv'
+  head, tail = os.urandom(6 * MB), os.urandom(MB + 17)
+  write(path, head)
+  assert sync.sync(['data/*.csv']) == (1, len(head))
+
+  write(path, tail, 'ab')
+  assert sync.sync(['data/*.csv']) == (1, len(tail)) # the first 6 MB are copied on the server
+  assert remote(client, 'Sessions.csv') == head + tail
+  assert sync.manifest.get(PREFIX + 'Sessions.csv')['etag'] == client.head_object(Bucket=BUCKET, Key=PREFIX + 'Sessions.csv')['ETag']
+
+
+def test_rewritten_file_is_uploaded_whole(client, sync, tmp_path):
+  path = tmp_path / 'data' / 'Sessions.csv'
+  write(path, os.urandom(6 * MB))
+  sync.sync(['data/*.csv'])
+
+  shrunk = os.urandom(5 * MB + 1)
+  write(path, shrunk)
+  assert sync.sync(['data/*.csv']) == (1, len(shrunk))
+  assert remote(client, 'Sessions.csv') == shrunk
+
+  grown = os.urandom(6 * MB) # larger, but with a different beginning
+  write(path, grown)
+  assert sync.sync(['data/*.csv']) == (1, len(grown))
+  assert remote(client, 'Sessions.csv') == grown
+
+
+def test_changed_remote_object_is_uploaded_whole(client, sync, tmp_path):
+  path = tmp_path / 'data' / 'Sessions.csv'
+  head, tail = os.urandom(6 * MB), os.urandom(MB)
+  write(path, head)
+  sync.sync(['data/*.csv'])
+
+  client.put_object(Bucket=BUCKET, Key=PREFIX + 'Sessions.csv', Body=b'replaced by another writer')
+  write(path, tail, 'ab')
+  assert sync.sync(['data/*.csv']) == (1, len(head) + len(tail))
+  assert remote(client, 'Sessions.csv') == head + tail
+
+
+def test_failed_append_is_aborted(client, sync, tmp_path, monkeypatch):
+  path = tmp_path / 'data' / 'Sessions.csv'
+  head = os.urandom(6 * MB)
+  write(path, head)
+  sync.sync(['data/*.csv'])
+
+  def failing_upload_part(**kwargs):
+    raise ConnectionError('connection reset')
+  monkeypatch.setattr(client, 'upload_part', failing_upload_part)
+  write(path, os.urandom(MB), 'ab')
+  with pytest.raises(ConnectionError):
+    sync.sync(['data/*.csv'])
+  assert 'Uploads' not in client.list_multipart_uploads(Bucket=BUCKET)
+  assert remote(client, 'Sessions.csv') == head
+  assert sync.manifest.get(PREFIX + 'Sessions.csv')['size'] == len(head) # the append is retried at the next sync
@@ -0,0 +1,65 @@
+# test_scheduler.py
+#
+# The order of a job and its dependency under short intervals and jitter, and run_now.
+
+import time, random, threading
+import pytest
+from scheduler import Job, Scheduler
+
+
+def recorder(runs, name, lock, seconds=0.02):
+  """Returns a job function appending the (name, start, end) of every run to runs."""
+  def run():
+    start = time.monotonic()
+    time.sleep(random.uniform(0, seconds))
+    with lock:
+      runs.append((name, start, time.monotonic()))
+  return run
+
+
+def start_scheduler(tmp_path, intervals, jitter):
+  runs, lock = [], threading.Lock()
+  scheduler = Scheduler(str(tmp_path / 'scheduler.json'), tick=0.005)
+  scheduler.add(Job('sessions', recorder(runs, 'sessions', lock), intervals[0], jitter=jitter))
+  scheduler.add(Job('alarms', recorder(runs, 'alarms', lock), intervals[1], depends_on=['sessions'], jitter=jitter))
+  thread = threading.Thread(target=scheduler.run_forever, daemon=True)
+  thread.start()
+  return scheduler, thread, runs
+
+
+def stop_scheduler(scheduler, thread, runs):
+  scheduler.stop()
+  thread.join()
+  time.sleep(0.05) # let the last runs finish
+  return sorted(runs, key=lambda run: run[1])
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_dependency_order(tmp_path, seed):
+  random.seed(seed)
+  scheduler, thread, runs = start_scheduler(tmp_path, (0.03, 0.02), jitter=0.02)
+  time.sleep(1.0)
+  runs = stop_scheduler(scheduler, thread, runs)
+  sessions = [run for run in runs if run[0] == 'sessions']
+  alarms = [run for run in runs if run[0] == 'alarms']
+  assert len(sessions) > 5 and len(alarms) > 5
+
+  # every alarm run follows a session run that started after the previous alarm run
+  previous_start = float('-inf')
+  for _, start, _ in alarms:
+    assert any(previous_start <= s_start and s_end <= start for _, s_start, s_end in sessions)
+    previous_start = start
+
+  # the two jobs never run at the same time
+  for (_, _, end), (_, next_start, _) in zip(runs, runs[1:]):
+    assert end <= next_start
+
+
+def test_run_now_triggers_stale_dependency(tmp_path):
+  scheduler, thread, runs = start_scheduler(tmp_path, (3600, 3600), jitter=0)
+  time.sleep(0.2)
+  assert [run[0] for run in runs] == ['sessions', 'alarms']
+  scheduler.run_now('alarms') # sessions did not run since alarms started, so it runs first
+  time.sleep(0.2)
+  runs = stop_scheduler(scheduler, thread, runs)
+  assert [run[0] for run in runs] == ['sessions', 'alarms', 'sessions', 'alarms']
@@ -0,0 +1,129 @@
+# test_soap_transport.py
+#
+# Retries, the shared rate limiter and the transport against a local stub SOAP server.
+
+import os, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from zeep.exceptions import Fault, TransportError
+from ChargePointApiClient import ChargePointApiClient
+from soap_transport import RateLimiter, RetryPolicy, build_transport, is_rate_limited, is_retryable
+
+WSDL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'stub.wsdl')
+
+RESPONSE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+               xmlns:ns1="urn:dictionary:com.chargepoint.webservices">
+  <soap:Body>
+    <ns1:getStationsResponse>
+      <responseCode>100</responseCode>
+      <stationData><stationID>1:11111</stationID></stationData>
+      <moreFlag>0</moreFlag>
+    </ns1:getStationsResponse>
+  </soap:Body>
+</soap:Envelope>'''
+
+
+def flaky(*errors, result='ok'):
+  """Returns an operation that raises the given errors, one per call, then returns result."""
+  calls = []
+  def operation(*args):
+    calls.append(time.monotonic())
+    if len(calls) <= len(errors): raise errors[len(calls) - 1]
+    return result
+  return operation, calls
+
+
+def test_connection_error_is_retried():
+  operation, calls = flaky(requests.ConnectionError('reset'), requests.Timeout('timed out'))
+  assert RetryPolicy(retries=3, base_delay=0.01).call(operation) == 'ok'
+  assert len(calls) == 3
+
+
+def test_retries_are_limited():
+  operation, calls = flaky(*[TransportError(status_code=503)] * 3)
+  with pytest.raises(TransportError):
+    RetryPolicy(retries=2, base_delay=0.01).call(operation)
+  assert len(calls) == 3
+
+
+def test_fault_is_raised_at_once():
+  operation, calls = flaky(Fault('Invalid station id'), TransportError(status_code=400))
+  with pytest.raises(Fault):
+    RetryPolicy(retries=3, base_delay=0.01).call(operation)
+  assert len(calls) == 1
+  assert not is_retryable(TransportError(status_code=400))
+  assert is_rate_limited(Fault('API call limit exceeded')) and is_retryable(Fault('API call limit exceeded'))
+
+
+def test_rate_limit_pauses_every_thread():
+  paused = threading.Event()
+  class Limiter(RateLimiter):
+    def pause(self, seconds):
+      super().pause(seconds)
+      self.paused_at = time.monotonic()
+      paused.set()
+
+  limiter = Limiter()
+  operation, calls = flaky(TransportError(status_code=429))
+  other, other_calls = flaky()
+  thread = threading.Thread(target=lambda: (paused.wait(), RetryPolicy(limiter=limiter).call(other)))
+  thread.start()
+  RetryPolicy(retries=1, base_delay=0.01, rate_limit_delay=0.3, limiter=limiter).call(operation)
+  thread.join()
+  # the other thread waited for the pause too, not only the one that was limited
+  assert other_calls[0] - limiter.paused_at >= 0.29
+  assert calls[1] - calls[0] >= 0.3
+
+
+@pytest.fixture
+def stub_server():
+  """Serves the stub WSDL and answers SOAP calls, the first one with HTTP 429."""
+  posts = []
+  class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+      with open(WSDL_PATH, 'rb') as f:
+        body = f.read().replace(b'http://127.0.0.1:1/stub', f'http://127.0.0.1:{self.server.server_port}/stub'.encode())
+      self.reply(200, body)
+
+    def do_POST(self):
+      self.rfile.read(int(self.headers['Content-Length']))
+      posts.append(self.path)
+      self.reply(429 if len(posts) == 1 else 200, b'Too Many Requests' if len(posts) == 1 else RESPONSE)
+
+    def reply(self, status, body):
+      self.send_response(status)
+      self.send_header('Content-Type', 'text/xml; charset=utf-8')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield f'http://127.0.0.1:{server.server_port}/stub?wsdl', posts, server
+  server.shutdown()
+  server.server_close()
+
+
+def test_local_wsdl_file(tmp_path):
+  client = ChargePointApiClient('key', 'secret', transport=build_transport(str(tmp_path / 'wsdl.sqlite')), wsdl_url=WSDL_PATH)
+  assert callable(client.serv_impl.getStations)
+
+
+def test_stub_server(tmp_path, stub_server):
+  wsdl_url, posts, server = stub_server
+  cache_path = str(tmp_path / 'cache' / 'wsdl.sqlite')
+  client = ChargePointApiClient('key', 'secret', transport=build_transport(cache_path), wsdl_url=wsdl_url)
+  retry = RetryPolicy(retries=2, base_delay=0.01, rate_limit_delay=0.05)
+  response = retry.call(client.serv_impl.getStations, {'stationID': '1:11111'})
+  assert len(posts) == 2 # the rate-limited call was retried
+  assert response['stationData'][0]['stationID'] == '1:11111'
+
+  # the cached documents are used while the WSDL host is unreachable
+  server.shutdown()
+  server.server_close()
+  client = ChargePointApiClient('key', 'secret', transport=build_transport(cache_path), wsdl_url=wsdl_url)
+  assert callable(client.serv_impl.getStations)
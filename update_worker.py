@@ -1,157 +1,227 @@
 # update_worker.py
 
-import os, sys, daemon, time, threading, configparser
+import os, sys, daemon, signal, configparser
 from datetime import datetime, timedelta
 import numpy as np
 import pandas as pd
 from ChargePointApiClient import ChargePointApiClient as API
 from ChargePointDatasetUtils import get_logger
-from anomalies import scan_anomalies
+from soap_transport import build_transport, RateLimiter, RetryPolicy
+from anomalies import scan_new_anomalies
+from backfill import backfill_sessions, remove_shards
+from storage import import_csv
+from dataset_cache import open_cached
+from key_index import open_index
+from interval_join import SessionIntervalIndex
+from scheduler import Job, Scheduler
+from rollups import update_rollups
+import metrics
+import schema
 
 cwd = os.getcwd()
 config = configparser.ConfigParser()
 config.read('config.ini')
 
 def update_session_data(client):
+  """Returns the function running one cycle of the session worker."""
   try:
     # read variables from config.ini
     log_path = config.get('Paths','session_log_path')
     session_data_path = config.get('Paths','session_data_path')
-    update_freq = int(config.get('Parameters', 'session_update_frequency'))
     anomaly_data_path = config.get('Paths','anomaly_data_path')
+    anomaly_watermark_path = config.get('Paths','anomaly_watermark_path')
+    full_rescan = [config.getboolean('Parameters', 'anomaly_full_rescan')] # only applies to the first cycle
+    shard_path = config.get('Paths','session_shard_path')
+    backfill_workers = int(config.get('Parameters', 'backfill_workers'))
+    backfill_start = datetime.strptime(config.get('Parameters', 'backfill_start'), '%Y-%m-%d')
+    compaction_freq = int(config.get('Storage', 'compaction_frequency'))
+    index_root = os.path.join(cwd, config.get('Storage', 'index_root'))
+    rollup_root = os.path.join(cwd, config.get('Storage', 'rollup_root'))
   except Exception as e:
     print('An error occurred:', str(e))
     return
 
   logger = get_logger('Session Worker', cwd, log_path)
-  # set default data path
-  default_path = os.path.join(cwd, session_data_path)
+  store = open_cached('sessions')
+  if import_csv(store, 'sessions'):
+    logger.info(f"Imported {session_data_path} into the session store.")
+  index = open_index('sessions', store, index_root) # session_ids of the stored sessions
 
-  while True:
+  def run():
     try:
-      
-      if os.path.exists(default_path):
-        main_data = pd.read_csv(default_path)
-      else:
-        main_data = pd.DataFrame() # if file not found, create an empty df, then a query from 1970-1-1 to now will be performed.
+      # if no data is stored, a query from backfill_start to now will be performed.
+      with metrics.stage('read'):
+        old_size = store.count()
+        # the latest session start, the API selects sessions by start time; sessions that
+        # started in the same second and are already stored are dropped by the key index
+        start_datetime_str = store.max("start_ts") if old_size else None # UTC time in the dataset
+      new_data = pd.DataFrame()
 
-      if not main_data.empty: # if old dataset exists
-        logger.info(f"Historical data Found in {session_data_path}.")
-        start_datetime_str = main_data.iloc[-1]["end_ts"] # UTC time in the dataset
-        start_datetime = datetime.fromtimestamp(int(start_datetime_str)+1)
-        latest_data = client.queryChargingSession(start_datetime)
-        
-        old_size = len(main_data)
-        # merge old and new data
-        main_data = pd.concat([main_data, latest_data]).drop_duplicates(subset='session_id')
-        main_data.to_csv(default_path, index=False)
-        if old_size != len(main_data):
-          logger.info("Data merged. Old size: {}, New size: {}.".format(old_size, len(main_data)))
+      if old_size: # if old dataset exists
+        logger.info("Historical data Found in the session store.")
+        start_datetime = datetime.fromtimestamp(int(start_datetime_str))
+        # append the sessions that are not stored yet, one batch of pages at a time
+        new_batches = []
+        for latest_data in client.iterChargingSessions(start_datetime):
+          with metrics.stage('dedupe') as stage:
+            new_batch = index.filter_new(latest_data)
+            stage.rows = len(new_batch)
+          with metrics.stage('write') as stage:
+            store.append(new_batch)
+            stage.rows = len(new_batch)
+          with metrics.stage('index'):
+            index.add(new_batch)
+          new_batches.append(new_batch)
+        if new_batches:
+          new_data = schema.concat(new_batches, 'sessions')
+        if len(new_data):
+          logger.info("Data merged. Old size: {}, New size: {}.".format(old_size, old_size + len(new_data)))
         else:
           logger.info("No new data found.")
         
-      else: # perform a query with time range (1970-1-1 00:00:00, Current UTC datetime) and save to the default path
-        start_datetime = datetime(1970, 1, 1)
+      else: # perform a query with time range (backfill_start, Current UTC datetime) and save to the default path
+        start_datetime = backfill_start
         end_datetime = datetime.utcnow()
         # start_datetime = datetime(2023,5,20)
         # end_datetime = datetime(2023,6,1)
-        logger.info("Sessions data file {} does not exist.".format(session_data_path))
+        logger.info("No session data is stored.")
         logger.info("Performing a default query from {}(UTC) to {}(UTC)".format(start_datetime, end_datetime.strftime("%Y-%m-%d %H:%M:%S")))
 
-        main_data = client.queryChargingSession(startTime=start_datetime, endTime=end_datetime)
-        main_data.to_csv(default_path, index=False)
+        # the range is queried month by month, completed months survive a restart
+        with metrics.stage('backfill') as stage:
+          new_data = backfill_sessions(client, os.path.join(cwd, shard_path), logger,
+                                       start_datetime, end_datetime, backfill_workers)
+          stage.rows = len(new_data)
+        with metrics.stage('write') as stage:
+          store.append(new_data)
+          stage.rows = len(new_data)
+        with metrics.stage('index'):
+          index.add(new_data)
+        remove_shards(os.path.join(cwd, shard_path))
         logger.info("Query completed.")
-        logger.info("Found {} row(s) of new data from {}(UTC) to {}(UTC).".format(len(main_data), start_datetime, end_datetime))
-        logger.info("Sessions data has been saved to {}.".format(session_data_path))
+        logger.info("Found {} row(s) of new data from {}(UTC) to {}(UTC).".format(len(new_data), start_datetime, end_datetime))
+        logger.info("Sessions data has been saved to the session store.")
       
-      scan_anomalies(cwd, session_data_path, anomaly_data_path, logger)
-      time.sleep(update_freq)
+      # only the rows appended in this cycle are scanned
+      with metrics.stage('anomaly_scan') as stage:
+        scan_new_anomalies(cwd, store, anomaly_data_path, anomaly_watermark_path,
+                           new_data, old_size, logger, full_rescan[0])
+        stage.rows = len(new_data)
+      full_rescan[0] = False
+      with metrics.stage('rollups') as stage:
+        update_rollups(rollup_root, store, new_data, old_size, logger)
+        stage.rows = len(new_data)
+      logger.info(f"ID hashing: {client.hasher}.")
+      with metrics.stage('compaction'):
+        store.compact_if_due(compaction_freq)
    
     except Exception as e:
+      metrics.error()
       logger.error(f"An exception occurred: {str(e)}")
-      return
+
+  return metrics.timed('sessions', run)
 
 def update_station_data(client):
+  """Returns the function running one cycle of the station worker."""
   try:
     # read variables from config.ini
     log_path = config.get('Paths','station_log_path')
-    station_data_path = config.get('Paths','station_data_path')
-    update_freq = int(config.get('Parameters', 'station_update_frequency'))
   except Exception as e:
     print('An error occurred:', str(e))
     return
   
-  while True:
-    try:
-      logger = get_logger('Station Worker', cwd, log_path)
-      default_path = os.path.join(cwd, station_data_path)
+  logger = get_logger('Station Worker', cwd, log_path)
+  store = open_cached('stations')
 
+  def run():
+    try:
       station_data = client.getStations()
       logger.info('{} station records found.'.format(len(station_data)))
 
-      station_data.to_csv(default_path, index=False)
-      logger.info('Stations data has been saved to {}'.format(station_data_path))
+      with metrics.stage('write') as stage:
+        store.overwrite(station_data) # the station list is replaced as a whole
+        stage.rows = len(station_data)
+      logger.info('Stations data has been saved to the station store.')
 
+    except Exception as e:
+      metrics.error()
+      logger.error(f'An error occurred: {str(e)}')
 
-      time.sleep(update_freq)
+  return metrics.timed('stations', run)
 
-    except Exception as e:
-      logger.error('An error occurred:', str(e))
-      return
-
-def query_session_for_id(alarms, sessions):
-  if alarms.empty or sessions.empty: return alarms
-  alarms['session_id'] = ''
-  for i, alarm_row in alarms.iterrows():
-      filtered_sessions = sessions[
-          (sessions['station_id'] == alarm_row['station_id'])&
-          (sessions['port_no'] == alarm_row['port_no'])
-      ]
-      matching_sessions = filtered_sessions[
-          (filtered_sessions['start_ts'] < alarm_row['alarm_ts']) &
-          (filtered_sessions['end_ts'] > alarm_row['alarm_ts'])
-      ]
-      if not matching_sessions.empty:
-          alarms.at[i, 'session_id'] = matching_sessions.iloc[0]['session_id']
+def query_session_for_id(alarms, sessions, session_index=None):
+  if alarms.empty: return alarms
+  if sessions.empty: # no alarm has a session, the column is still written
+    alarms['session_id'] = ''
+    return alarms
+  # find the session in progress on the alarm's station port at the alarm time
+  session_index = session_index or SessionIntervalIndex(sessions)
+  positions = session_index.lookup(alarms, 'alarm_ts')
+  session_ids = sessions['session_id'].to_numpy(dtype=object)
+  alarms['session_id'] = np.where(positions >= 0, session_ids[positions], '')
 
   return alarms
 
+def append_alarms(client, store, index, sessions, start_datetime, end_datetime):
+  """Streams the new alarms of a time range into the store; returns their count and time range."""
+  with metrics.stage('join'):
+    session_index = SessionIntervalIndex(sessions) # built once for all batches
+  rows, first_ts, last_ts = 0, None, None
+  for latest_data in client.iterAlarms(start_datetime, end_datetime):
+    # Query session_ids from sessions
+    with metrics.stage('join') as stage:
+      latest_data = query_session_for_id(latest_data, sessions, session_index)
+      stage.rows = len(latest_data)
+    with metrics.stage('dedupe') as stage:
+      new_data = index.filter_new(latest_data)
+      stage.rows = len(new_data)
+    with metrics.stage('write') as stage:
+      store.append(new_data)
+      stage.rows = len(new_data)
+    with metrics.stage('index'):
+      index.add(new_data)
+    if len(new_data):
+      rows += len(new_data)
+      batch_first, batch_last = new_data['alarm_ts'].min(), new_data['alarm_ts'].max()
+      first_ts = batch_first if first_ts is None else min(first_ts, batch_first)
+      last_ts = batch_last if last_ts is None else max(last_ts, batch_last)
+  return rows, first_ts, last_ts
+
 def update_alarm_data(client):
+  """Returns the function running one cycle of the alarm worker."""
   try:
     alarm_data_path = config.get('Paths', 'alarm_data_path')
     alarm_log_path = config.get('Paths', 'alarm_log_path')
-    alarm_update_frequency = int(config.get('Parameters', 'alarm_update_frequency'))
-    session_data_path = config.get('Paths','session_data_path')
+    compaction_freq = int(config.get('Storage', 'compaction_frequency'))
+    index_root = os.path.join(cwd, config.get('Storage', 'index_root'))
   except Exception as e:
     print(str(e))
     return
   logger = get_logger('Alarm Worker', cwd, alarm_log_path)
-  # set default data path
-  default_path = os.path.join(cwd, alarm_data_path)
-  while True:
+  store = open_cached('alarms')
+  session_store = open_cached('sessions') # the cached sessions of the session worker
+  if import_csv(store, 'alarms'):
+    logger.info(f"Imported {alarm_data_path} into the alarm store.")
+  index = open_index('alarms', store, index_root) # station, port, type and time of the stored alarms
+  session_columns = ['session_id', 'station_id', 'port_no', 'start_ts', 'end_ts']
+
+  def run():
     try:
-      if os.path.exists(default_path):
-        main_data = pd.read_csv(default_path)
-      else:
-        main_data = pd.DataFrame()
+      with metrics.stage('read'):
+        old_size = store.count()
+        start_datetime_str = store.max("alarm_ts") if old_size else None # UTC time in the dataset
 
-      if not main_data.empty:
-        logger.info(f"Historical data Found in {alarm_data_path}.")
-        start_datetime_str = main_data.iloc[-1]["alarm_ts"] # UTC time in the dataset
+      if old_size:
+        logger.info("Historical data Found in the alarm store.")
         start_datetime = datetime.fromtimestamp(int(start_datetime_str))
         end_datetime = datetime.utcnow()
-        latest_data = client.getAlarms(start_datetime, end_datetime)
-
-        old_size = len(main_data)
-        # Query session_ids from sessions
-        sessions = pd.read_csv(os.path.join(cwd, session_data_path))
-        latest_data = query_session_for_id(latest_data, sessions)
-
-        # merge old and new data
-        main_data = pd.concat([main_data, latest_data]).drop_duplicates(subset='alarm_ts')
-        main_data.to_csv(default_path, index=False)
-        if old_size != len(main_data):
-          logger.info("Data merged. Old size: {}, New size: {}.".format(old_size, len(main_data)))
+
+        # append the alarms that are not stored yet
+        with metrics.stage('read'):
+          sessions = session_store.read(columns=session_columns)
+        rows, _, _ = append_alarms(client, store, index, sessions, start_datetime, end_datetime)
+        if rows:
+          logger.info("Data merged. Old size: {}, New size: {}.".format(old_size, old_size + rows))
         else:
           logger.info("No new data found.")
 
@@ -160,46 +230,64 @@ def update_alarm_data(client):
         end_datetime = datetime.utcnow()
         # start_datetime = datetime(2023,7,1)
         # end_datetime = datetime(2023,7,2)
-        logger.info("Alarms data file {} does not exist.".format(alarm_data_path))
+        logger.info("No alarm data is stored.")
         logger.info("Performing a default query from {}(UTC) to {}(UTC)".format(start_datetime, end_datetime.strftime("%Y-%m-%d %H:%M:%S")))
 
-        main_data = client.getAlarms(startTime=start_datetime, endTime=end_datetime)
-        # Query session_ids from sessions
-        sessions = pd.read_csv(session_data_path)
-        main_data = query_session_for_id(main_data, sessions)
-
-        main_data.to_csv(default_path, index=False)
-        start_ts, end_ts = datetime.fromtimestamp(int(main_data.iloc[0]['alarm_ts'])), datetime.fromtimestamp(int(main_data.iloc[-1]['alarm_ts']))
+        with metrics.stage('read'):
+          sessions = session_store.read(columns=session_columns)
+        rows, first_ts, last_ts = append_alarms(client, store, index, sessions, start_datetime, end_datetime)
         logger.info("Query completed.")
-        logger.info("Found {} row(s) of new data from {}(UTC) to {}(UTC).".format(len(main_data), start_ts, end_ts))
-        logger.info("Alarms data has been saved to {}.".format(alarm_data_path))
+        if rows:
+          start_ts, end_ts = datetime.fromtimestamp(int(first_ts)), datetime.fromtimestamp(int(last_ts))
+          logger.info("Found {} row(s) of new data from {}(UTC) to {}(UTC).".format(rows, start_ts, end_ts))
+        logger.info("Alarms data has been saved to the alarm store.")
 
-      time.sleep(alarm_update_frequency)
+      with metrics.stage('compaction'):
+        store.compact_if_due(compaction_freq)
     except Exception as e:
       print(str(e))
-      logger.error('An error occurred:', str(e))
-      return
+      metrics.error()
+      logger.error(f'An error occurred: {str(e)}')
+
+  return metrics.timed('alarms', run)
 
 
-def start_worker(func, client):
-  th = threading.Thread(target=func, args=(client, ))
-  th.start()
-  print(f'Thread {func.__name__} started.')
-  return th
+def start_scheduler(client):
+  """Schedules the three workers; alarms are joined to sessions, so they run after them."""
+  logger = get_logger('Scheduler', cwd, config.get('Scheduler', 'log_path'))
+  scheduler = Scheduler(os.path.join(cwd, config.get('Scheduler', 'state_path')), logger)
+  jitter = config.getfloat('Scheduler', 'jitter')
+
+  scheduler.add(Job('sessions', update_session_data(client), int(config.get('Parameters', 'session_update_frequency')), jitter=jitter))
+  scheduler.add(Job('stations', update_station_data(client), int(config.get('Parameters', 'station_update_frequency')), jitter=jitter))
+  scheduler.add(Job('alarms', update_alarm_data(client), int(config.get('Parameters', 'alarm_update_frequency')),
+                    depends_on=['sessions'], jitter=jitter))
+  return scheduler
 
 if __name__ == "__main__":
-    threads = []
     with daemon.DaemonContext(stdout=sys.stdout) as context:
         print(os.getpid())
         try:
           api_key, secret = [v for k,v in config.items('ChargePoint')]
-          client = API(api_key, secret)
-
-          functions = [update_session_data, update_station_data, update_alarm_data]
+          transport = build_transport(os.path.join(cwd, config.get('Transport', 'wsdl_cache_path')),
+                                      pool_size=config.getint('Transport', 'pool_size'),
+                                      timeout=config.getint('Transport', 'timeout'),
+                                      operation_timeout=config.getint('Transport', 'operation_timeout'),
+                                      cache_ttl=config.getint('Transport', 'wsdl_cache_ttl'))
+          retry = RetryPolicy(retries=config.getint('Transport', 'retries'),
+                              base_delay=config.getfloat('Transport', 'backoff_base'),
+                              max_delay=config.getfloat('Transport', 'backoff_max'),
+                              rate_limit_delay=config.getfloat('Transport', 'rate_limit_delay'),
+                              limiter=RateLimiter(config.getfloat('Transport', 'requests_per_second')))
+          client = API(api_key, secret, max_workers=int(config.get('Parameters', 'api_concurrency')),
+                       transport=transport, retry=retry, wsdl_url=config.get('Transport', 'wsdl_url'))
 
-          threads = [start_worker(func, client) for func in functions]
+          metrics.configure(os.path.join(cwd, config.get('Metrics', 'json_log_path')),
+                            os.path.join(cwd, config.get('Metrics', 'update_prometheus_path')))
+          scheduler = start_scheduler(client)
+          # kill -USR1 <pid> runs every job now, e.g. after a configuration change
+          signal.signal(signal.SIGUSR1, lambda signum, frame: scheduler.run_now())
+          scheduler.run_forever()
           
         except Exception as e:
-          print(f"An exception occurred: {str(e)}")
-          for th in threads:
-            th.join()
\ No newline at end of file
+          print(f"An exception occurred: {str(e)}")
\ No newline at end of file
@@ -1,7 +1,11 @@
 import configparser
 import boto3
-import daemon, sys, os, time, threading, glob
+import daemon, sys, os, time, threading
 from ChargePointDatasetUtils import get_logger
+from storage import export_all
+from s3_sync import S3Sync
+from publish import publish_all
+import metrics
 
 cwd = os.getcwd()
 config = configparser.ConfigParser()
@@ -9,28 +13,33 @@ config.read('config.ini')
 
 def upload_files(client):
     
-    bucket_name = 'ieee-dataport'
-    prefix = 'open/27422/11280/'
-
     logger = get_logger('Upload Worker', cwd, 'log/upload.log')
     upload_frequency = int(config.get('Parameters', 'upload_frequency'))
-    
-    file_list = glob.glob(f'{cwd}/data/*')
-    logs = glob.glob(f'{cwd}/log/*')
-    file_list.extend(logs)
+    patterns = [pattern.strip() for pattern in config.get('Upload', 'patterns').split(',')]
+
+    sync = S3Sync(client, config.get('Upload', 'bucket'), config.get('Upload', 'prefix'),
+                  os.path.join(cwd, config.get('Upload', 'manifest_path')), root=cwd,
+                  max_workers=int(config.get('Upload', 'max_workers')),
+                  multipart_threshold=int(config.get('Upload', 'multipart_threshold')),
+                  multipart_chunksize=int(config.get('Upload', 'multipart_chunksize')))
     
     while True:
         try:
-            for file in file_list:
-                file_name = file.split('/')[-1]
-                file_key = f'{prefix}{file_name}'
-                client.upload_file(file, bucket_name, file_key)
-                logger.info(f"File uploaded: {file_name}")
-            
-            time.sleep(upload_frequency)
+            with metrics.cycle('upload'):
+                with metrics.stage('export'):
+                    export_all() # the CSV files are exported from the store on demand
+                with metrics.stage('publish'):
+                    publish_all(logger=logger) # compressed monthly files, only changed months are rewritten
+                # the directories are scanned again every cycle, unchanged files are skipped
+                with metrics.stage('upload') as stage:
+                    files, sent = sync.sync(patterns, logger)
+                    stage.rows = files
+            logger.info(f"{files} file(s) uploaded, {sent} byte(s) sent.")
     
         except Exception as e:
             logger.error(f"An exception occurred: {str(e)}")
+
+        time.sleep(upload_frequency) # a failed cycle is retried at the next one, not at once
         
     
 
@@ -54,6 +63,8 @@ if __name__ == '__main__':
                     aws_access_key_id=access_key,
                     aws_secret_access_key=secret
                 )
+            metrics.configure(os.path.join(cwd, config.get('Metrics', 'json_log_path')),
+                              os.path.join(cwd, config.get('Metrics', 'upload_prometheus_path')))
             start_upload_worker(s3_client)
         
         except Exception as e: